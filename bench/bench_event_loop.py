@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Compare the asyncio and uvloop event loops on / and /api/blogs.
+
+For each loop a single worker server is started with `web_app.py --loop <loop>`
+(the database of the config must be reachable) and hit by -c concurrent clients
+for -n requests per path. Requires uvloop to be installed for a meaningful result.
+
+Usage: python3 bench/bench_event_loop.py [-n 2000] [-c 50] [--port 18080]
+'''
+
+import argparse, asyncio, os, subprocess, sys, time
+
+import aiohttp
+
+WWW = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'www')
+PATHS = ('/', '/api/blogs')
+
+
+async def wait_for_server(url, timeout=30):
+    deadline = time.time() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.time() < deadline:
+            try:
+                async with session.get(url) as r:
+                    await r.read()
+                    return
+            except aiohttp.ClientError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError('server did not start at %s' % url)
+
+
+async def load(url, n, concurrency):
+    latencies = []
+    remaining = [n]
+
+    async def client(session):
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            start = time.perf_counter()
+            async with session.get(url) as r:
+                await r.read()
+                if r.status != 200:
+                    raise RuntimeError('%s returned %s' % (url, r.status))
+            latencies.append(time.perf_counter() - start)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*[client(session) for i in range(concurrency)])
+        elapsed = time.perf_counter() - start
+    latencies.sort()
+    return n / elapsed, latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+
+
+def bench(loop, args):
+    base = 'http://127.0.0.1:%s' % args.port
+    server = subprocess.Popen([sys.executable, 'web_app.py', '--workers', '1', '--loop', loop, '--port', str(args.port)],
+                              cwd=WWW, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        asyncio.run(wait_for_server(base + '/'))
+        for path in PATHS:
+            rps, p50, p99 = asyncio.run(load(base + path, args.n, args.c))
+            print('%-8s %-12s %8.1f req/s  p50 %6.2f ms  p99 %6.2f ms' % (loop, path, rps, p50 * 1000, p99 * 1000))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='event loop benchmark')
+    parser.add_argument('-n', type=int, default=2000, help='requests per path')
+    parser.add_argument('-c', type=int, default=50, help='concurrent clients')
+    parser.add_argument('--port', type=int, default=18080)
+    args = parser.parse_args()
+    for loop in ('asyncio', 'uvloop'):
+        bench(loop, args)
+
+
+if __name__ == '__main__':
+    main()
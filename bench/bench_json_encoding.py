@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Benchmark of the json encoding of an /api/blogs payload: dict(page=Page, blogs=[...]).
+
+'legacy' is the encoding response_factory used before encoder.py: json.dumps with a __dict__ default.
+'json' and 'orjson' are the encoder backends (orjson only when installed), whole and streamed by
+encoder.iter_dumps, each for three kinds of blogs:
+
+  models  Blog models, what findAll returns by default
+  rows    the readonly=True Blog.__row__ objects, encoded through encoder.default()
+  dicts   the as_dicts=True plain dicts the list apis return
+
+'build' is the time to turn the tuples of the database driver into the kind of blogs, the json of
+an api answer costs build + encode. The largest part is the largest bytes object held at once.
+
+Usage: python3 bench/bench_json_encoding.py [-n 1000] [-r 50]
+'''
+
+import argparse, gc, json, logging, os, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'www'))
+
+logging.basicConfig(level=logging.INFO, stream=open(os.devnull, 'w'), force=True)
+
+import encoder, orm
+from apis import Page
+from models import Blog
+
+FIELDS = ('id', 'user_id', 'user_name', 'user_image', 'name', 'summary', 'created_at')
+
+
+def make_tuples(n):
+    columns = Blog.getColumns(FIELDS)
+    values = lambda i: dict(id='%050d' % i, user_id='%050d' % 1, user_name='admin', user_image='about:blank',
+                            name='Blog title %s' % i, summary='A short summary of blog %s, ünïcode' % i,
+                            created_at=1500000000.0 + i)
+    return columns, [tuple(values(i)[c] for c in columns) for i in range(n)]
+
+
+# kind => function building the blogs from the columns and tuples of the driver
+BUILDERS = {
+    'models': lambda columns, rs: [Blog(**dict(zip(columns, r))) for r in rs],
+    'rows': lambda columns, rs: Blog.__row__.fromTuples(columns, rs),
+    'dicts': orm.dictsFromTuples
+}
+
+
+def legacy(payload):
+    return [json.dumps(payload, ensure_ascii=False, default=lambda o: o._asdict() if hasattr(o, '_asdict') else o.__dict__).encode('utf-8')]
+
+
+def whole(payload):
+    return [encoder.dumps(payload)]
+
+
+def streamed(payload):
+    return list(encoder.iter_dumps(payload))
+
+
+def measure(func, arg, repeat):
+    best = None
+    for i in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = func(arg)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='json encoding benchmark')
+    parser.add_argument('-n', type=int, default=1000, help='number of blogs')
+    parser.add_argument('-r', type=int, default=50, help='repeat, the best time is reported')
+    args = parser.parse_args()
+    columns, rs = make_tuples(args.n)
+    page = Page(item_count=args.n, page_index=1, page_size=args.n)
+    payloads = dict()
+    for kind, build in BUILDERS.items():
+        elapsed, blogs = measure(lambda rs: build(columns, rs), rs, args.r)
+        payloads[kind] = dict(page=page, blogs=blogs)
+        print('%-14s %-6s %8.2f ms / %s blogs' % ('build', kind, elapsed * 1000, args.n))
+    cases = [('legacy', None, legacy)]
+    for backend in sorted(encoder.BACKENDS):
+        cases.append((backend, backend, whole))
+        cases.append((backend + '/stream', backend, streamed))
+    for name, backend, func in cases:
+        if backend is not None:
+            encoder.use(backend)
+        for kind, payload in payloads.items():
+            elapsed, parts = measure(func, payload, args.r)
+            print('%-14s %-6s %8.2f ms / %s blogs  %8s bytes  largest part %8s bytes' % (
+                name, kind, elapsed * 1000, args.n, sum(len(p) for p in parts), max(len(p) for p in parts)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Benchmark of the hydration of query results into Blog objects.
+
+'model' is the default path: DictCursor rows turned into Blog(**row).
+'row' is the readonly=True path: plain tuples turned into slot based Blog.__row__ objects.
+
+Usage: python3 bench/bench_row_hydration.py [-n 10000] [-r 20]
+'''
+
+import argparse, gc, logging, os, sys, time, tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'www'))
+
+logging.basicConfig(level=logging.INFO, stream=open(os.devnull, 'w'), force=True)
+
+from models import Blog
+
+
+def make_tuples(n):
+    columns = Blog.getColumns()
+    rs = []
+    for i in range(n):
+        row = dict(id='%050d' % i, user_id='%050d' % 1, user_name='admin', user_image='about:blank',
+                   name='Blog title %s' % i, summary='A short summary of blog %s' % i,
+                   content='Blog content ' * 100, created_at=1500000000.0 + i)
+        rs.append(tuple(row.get(c) for c in columns))
+    return columns, rs
+
+
+def hydrate_models(columns, rs):
+    # what DictCursor and findAll do for each row
+    return [Blog(**dict(zip(columns, r))) for r in rs]
+
+
+def hydrate_rows(columns, rs):
+    return Blog.__row__.fromTuples(columns, rs)
+
+
+def measure(func, columns, rs, repeat):
+    best = None
+    for i in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func(columns, rs)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objs = func(columns, rs)
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del objs
+    return best, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description='row hydration benchmark')
+    parser.add_argument('-n', type=int, default=10000, help='number of rows')
+    parser.add_argument('-r', type=int, default=20, help='repeat, the best time is reported')
+    args = parser.parse_args()
+    columns, rs = make_tuples(args.n)
+    for name, func in (('model', hydrate_models), ('row', hydrate_rows)):
+        elapsed, size = measure(func, columns, rs, args.r)
+        print('%-6s %8.2f ms / %s rows  %6.1f bytes / row' % (name, elapsed * 1000, args.n, size / args.n))
+
+
+if __name__ == '__main__':
+    main()
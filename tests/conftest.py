@@ -0,0 +1,4 @@
+import os, sys
+
+# the modules of the app import each other from www/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'www'))
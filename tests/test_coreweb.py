@@ -0,0 +1,49 @@
+import asyncio, sys, types
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from coreweb import get, add_routes
+from apis import APIValueError
+from factories import metrics_factory, logger_factory, loader_factory, data_factory, auth_factory, \
+    page_cache_factory, single_flight_factory, response_factory
+
+
+@get('/test/dict')
+async def route_dict(*, name='world'):
+    return dict(hello=name)
+
+
+@get('/test/text/{id}')
+async def route_text(request, *, id):
+    return 'text %s' % id
+
+
+@get('/test/error')
+async def route_error():
+    raise APIValueError('name', 'bad name')
+
+
+def make_app():
+    mod = types.ModuleType('coreweb_test_routes')
+    for func in (route_dict, route_text, route_error):
+        setattr(mod, func.__name__, func)
+    sys.modules[mod.__name__] = mod
+    app = web.Application(middlewares=[metrics_factory, logger_factory, loader_factory, data_factory, auth_factory,
+                                       page_cache_factory, single_flight_factory, response_factory])
+    add_routes(app, mod.__name__)
+    return app
+
+
+def test_routes_return_values_through_middlewares():
+    async def run():
+        async with TestClient(TestServer(make_app())) as client:
+            r = await client.get('/test/dict?name=awesome')
+            assert r.status == 200
+            assert await r.json() == dict(hello='awesome')
+            r = await client.get('/test/text/7')
+            assert r.status == 200
+            assert await r.text() == 'text 7'
+            r = await client.get('/test/error')
+            assert r.status == 200
+            assert (await r.json())['error'] == 'value:invalid'
+
+    asyncio.run(run())
@@ -0,0 +1,56 @@
+import asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from pagecache import PageCache
+
+
+def make_app(cookie):
+    cache = PageCache({'/page': ('pages',)})
+
+    async def page(request):
+        res = web.Response(body=b'page')
+        if cookie:
+            res.set_cookie('visitor', 'secret')
+        return res
+
+    @web.middleware
+    async def page_cache(request, handler):
+        request.__user__ = None
+        tags = cache.route_tags(request)
+        res = cache.get(request)
+        if res is not None:
+            return res
+        generation = cache.generation
+        res = await handler(request)
+        cache.set(request, res, tags, generation)
+        return res
+
+    app = web.Application(middlewares=[page_cache])
+    app.router.add_get('/page', page)
+    return app, cache
+
+
+def run(cookie):
+    async def main():
+        app, cache = make_app(cookie)
+        async with TestClient(TestServer(app)) as client:
+            first = await client.get('/page')
+            await first.read()
+            second = await client.get('/page')
+            await second.read()
+            return first, second, cache.stats()['size']
+
+    return asyncio.run(main())
+
+
+def test_page_is_cached():
+    first, second, size = run(cookie=False)
+    assert size == 1
+    assert second.headers.get('X-Cache') == 'HIT'
+
+
+def test_page_setting_a_cookie_is_not_cached():
+    first, second, size = run(cookie=True)
+    assert size == 0
+    assert second.headers.get('X-Cache') is None
+    assert second.cookies['visitor'].value == 'secret'
@@ -0,0 +1,56 @@
+import asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from factories import single_flight_factory
+
+
+def make_app(calls):
+    @web.middleware
+    async def anonymous(request, handler):
+        request.__user__ = None
+        return await handler(request)
+
+    async def page(request):
+        calls.append(request.path)
+        await asyncio.sleep(0.1)
+        if request.path == '/missing':
+            raise web.HTTPNotFound()
+        if request.headers.get('If-None-Match') == 'W/"v1"':
+            raise web.HTTPNotModified(headers={'ETag': 'W/"v1"'})
+        return web.Response(body=b'page', headers={'ETag': 'W/"v1"'})
+
+    app = web.Application(middlewares=[anonymous, single_flight_factory])
+    app.router.add_get('/page', page)
+    app.router.add_get('/missing', page)
+    return app
+
+
+def run_concurrently(path, headers=None, n=3):
+    calls = []
+
+    async def main():
+        async with TestClient(TestServer(make_app(calls))) as client:
+            async def get():
+                r = await client.get(path, headers=headers, timeout=5)
+                return r.status, await r.read(), r.headers.get('ETag')
+            return await asyncio.gather(*[get() for i in range(n)])
+
+    return asyncio.run(main()), calls
+
+
+def test_ok_is_shared():
+    results, calls = run_concurrently('/page')
+    assert results == [(200, b'page', 'W/"v1"')] * 3
+    assert len(calls) == 1
+
+
+def test_not_modified_is_shared():
+    results, calls = run_concurrently('/page', headers={'If-None-Match': 'W/"v1"'})
+    assert [(status, etag) for status, body, etag in results] == [(304, 'W/"v1"')] * 3
+    assert len(calls) == 1
+
+
+def test_not_found_is_shared():
+    results, calls = run_concurrently('/missing')
+    assert [(status, body) for status, body, etag in results] == [(404, b'404: Not Found')] * 3
+    assert len(calls) == 1
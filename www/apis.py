@@ -1,4 +1,4 @@
-import logging
+import base64, json, logging
 
 logging.basicConfig(level=logging.INFO)
 
@@ -26,6 +26,71 @@ class Page(object):
     __repr__ = __str__
 
 
+class CursorPage(object):
+    '''
+    Page for keyset pagination. Unlike Page there is no count and no offset, next / prev
+    are opaque cursors pointing after the last item / before the first item of the page.
+    '''
+
+    def __init__(self, cursor='', page_size=10):
+        self.cursor = cursor
+        self.page_size = page_size
+        self.has_next = False
+        self.has_previous = False
+        self.next = None
+        self.prev = None
+
+    def query(self, keyset):
+        # return the keyword arguments for Model.findAll, one extra row tells if there is more
+        kw = dict(limit=self.page_size + 1)
+        if self.cursor:
+            direction, values = decode_cursor(self.cursor, len(keyset))
+            kw['after' if direction == 'a' else 'before'] = values
+        return kw
+
+    def fill(self, items, keyset):
+        direction = decode_cursor(self.cursor)[0] if self.cursor else None
+        more = len(items) > self.page_size
+        if more:
+            # the extra row is the last one going forward and the first one going backward
+            items = items[1:] if direction == 'b' else items[:self.page_size]
+        if direction == 'b':
+            self.has_previous, self.has_next = more, True
+        else:
+            self.has_previous, self.has_next = direction == 'a', more
+        if items:
+            if self.has_next:
+                self.next = encode_cursor('a', [items[-1][k] for k in keyset])
+            if self.has_previous:
+                self.prev = encode_cursor('b', [items[0][k] for k in keyset])
+        return items
+
+    def __str__(self):
+        return 'cursor: %s, page_size: %s, has_next: %s, has_previous: %s' % (self.cursor, self.page_size, self.has_next, self.has_previous)
+
+    __repr__ = __str__
+
+
+def encode_cursor(direction, values):
+    s = json.dumps([direction] + list(values), separators=(',', ':'))
+    return base64.urlsafe_b64encode(s.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, size=None):
+    # size is the number of keyset columns, a cursor of another size or with a list / object value is rejected
+    try:
+        s = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        L = json.loads(s)
+        if not isinstance(L, list) or len(L) < 2 or L[0] not in ('a', 'b'):
+            raise ValueError('invalid cursor')
+        if size is not None and len(L) != size + 1:
+            raise ValueError('invalid cursor')
+        if not all(isinstance(v, (str, int, float)) and not isinstance(v, bool) for v in L[1:]):
+            raise ValueError('invalid cursor')
+        return L[0], tuple(L[1:])
+    except ValueError:
+        raise APIValueError('cursor', 'Invalid cursor: %s' % cursor)
+
 
 class APIError(Exception):
     '''
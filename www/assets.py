@@ -0,0 +1,153 @@
+import gzip, hashlib, logging, mimetypes, os
+from aiohttp import web
+
+logging.basicConfig(level=logging.INFO)
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# a compressed variant is only kept when it saves at least this ratio, i.e. not for png or woff
+MIN_COMPRESSION_RATIO = 0.1
+
+
+def parse_accept_encoding(header):
+    # return {encoding: q} of the Accept-Encoding header
+    encodings = dict()
+    for part in (header or '').split(','):
+        L = part.strip().split(';')
+        if not L[0]:
+            continue
+        q = 1.0
+        for param in L[1:]:
+            k, _, v = param.strip().partition('=')
+            if k == 'q':
+                try:
+                    q = float(v)
+                except ValueError:
+                    q = 0.0
+        encodings[L[0].strip().lower()] = q
+    return encodings
+
+
+def _opaque_tag(etag):
+    return etag[2:] if etag.startswith('W/') else etag
+
+
+def etag_matches(header, etag):
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    # weak comparison as required for If-None-Match, W/"x" matches "x" both ways
+    opaque = _opaque_tag(etag)
+    return any(_opaque_tag(t.strip()) == opaque for t in header.split(','))
+
+
+class Asset(object):
+    '''
+    A static file held in memory with its precompressed variants and their ETags.
+    '''
+
+    def __init__(self, body, content_type, gzip_level=9):
+        self.content_type = content_type
+        self.digest = hashlib.sha1(body).hexdigest()
+        # encoding => (body, strong etag), each representation has its own etag
+        self.variants = {'identity': (body, '"%s"' % self.digest)}
+        compressed = gzip.compress(body, gzip_level)
+        if len(compressed) <= len(body) * (1 - MIN_COMPRESSION_RATIO):
+            self.variants['gzip'] = (compressed, '"%s-gz"' % self.digest)
+        if brotli is not None:
+            compressed = brotli.compress(body)
+            if len(compressed) <= len(body) * (1 - MIN_COMPRESSION_RATIO):
+                self.variants['br'] = (compressed, '"%s-br"' % self.digest)
+
+    def negotiate(self, accept_encoding):
+        # smallest variant accepted by the client
+        accepted = parse_accept_encoding(accept_encoding)
+        best = 'identity'
+        for encoding in ('br', 'gzip'):
+            if encoding in self.variants and accepted.get(encoding, accepted.get('*', 0)) > 0:
+                if len(self.variants[encoding][0]) < len(self.variants[best][0]):
+                    best = encoding
+        return best
+
+
+class StaticFiles(object):
+    '''
+    Serve the files under path at prefix from memory, loaded once at startup.
+    '''
+
+    def __init__(self, path, prefix='/static/', max_age=3600, gzip_level=9, immutable_max_age=31536000):
+        self.path = path
+        self.prefix = prefix
+        self.max_age = max_age
+        self.gzip_level = gzip_level
+        self.immutable_max_age = immutable_max_age
+        self.assets = dict()
+        # manifest of the content-hashed names, i.e. css/awesome.css <=> css/awesome.0123456789ab.css
+        self.fingerprints = dict()
+        self.urls = dict()
+        self.load()
+
+    def load(self):
+        assets = dict()
+        for root, dirs, files in os.walk(self.path):
+            for f in files:
+                fullpath = os.path.join(root, f)
+                name = os.path.relpath(fullpath, self.path).replace(os.sep, '/')
+                with open(fullpath, 'rb') as fp:
+                    body = fp.read()
+                content_type = mimetypes.guess_type(f)[0] or 'application/octet-stream'
+                assets[name] = Asset(body, content_type, self.gzip_level)
+        self.assets = assets
+        self.fingerprints = dict()
+        self.urls = dict()
+        for name, asset in assets.items():
+            base, ext = os.path.splitext(name)
+            fingerprinted = '%s.%s%s' % (base, asset.digest[:12], ext)
+            self.fingerprints[fingerprinted] = asset
+            self.urls[name] = self.prefix + fingerprinted
+        raw = sum(len(a.variants['identity'][0]) for a in assets.values())
+        logging.info('loaded %s static files (%s bytes) from %s' % (len(assets), raw, self.path))
+
+    def serve(self, request):
+        # return the response for request, None when the file is not in memory
+        if request.method not in ('GET', 'HEAD') or not request.path.startswith(self.prefix):
+            return None
+        name = request.path[len(self.prefix):]
+        asset = self.assets.get(name, None)
+        if asset is not None:
+            return self.respond(request, asset, 'public, max-age=%s' % self.max_age)
+        # the url of a fingerprinted name changes with the content, so it can be cached forever
+        asset = self.fingerprints.get(name, None)
+        if asset is not None:
+            return self.respond(request, asset, 'public, max-age=%s, immutable' % self.immutable_max_age)
+        return None
+
+    def url(self, name):
+        '''
+        Return the content-hashed url of a file, used in templates as {{ asset_url('css/awesome.css') }}.
+        '''
+        url = self.urls.get(name, None)
+        if url is None:
+            logging.warning('static file not found: %s' % name)
+            return self.prefix + name
+        return url
+
+    def respond(self, request, asset, cache_control):
+        encoding = asset.negotiate(request.headers.get('Accept-Encoding'))
+        body, etag = asset.variants[encoding]
+        headers = {
+            'ETag': etag,
+            'Cache-Control': cache_control,
+            'Vary': 'Accept-Encoding'
+        }
+        if etag_matches(request.headers.get('If-None-Match'), etag):
+            return web.Response(status=304, headers=headers)
+        headers['Content-Type'] = asset.content_type
+        if encoding != 'identity':
+            headers['Content-Encoding'] = encoding
+        # aiohttp leaves the body out of the answer to a HEAD request
+        return web.Response(body=body, headers=headers)
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Render the html of the blogs and comments which have none stored, or a stale one.
+
+Add the columns once before deploying:
+
+    ALTER TABLE `blogs` ADD COLUMN `html_content` mediumtext, ADD COLUMN `html_digest` varchar(50);
+    ALTER TABLE `comments` ADD COLUMN `html_content` text, ADD COLUMN `html_digest` varchar(50);
+
+then run `python3 backfill_html.py` from www/, again after markup.RENDER_VERSION is bumped.
+Until a row is backfilled the views render its html on every request.
+'''
+
+import argparse, asyncio, logging
+import orm, markup
+from models import Blog, Comment
+from config import configs
+
+logging.basicConfig(level=logging.INFO)
+
+_FIELDS = ('content', 'html_content', 'html_digest')
+
+
+async def backfill(model, render, batch=500, dry_run=False):
+    sql = 'UPDATE `%s` SET `html_content`=?, `html_digest`=? WHERE `%s`=?' % (model.__table__, model.__primary_key__)
+    scanned = updated = 0
+    async for rows in model.stream(fields=_FIELDS, batch=batch, readonly=True):
+        scanned += len(rows)
+        seq_of_args = []
+        for row in rows:
+            if not markup.is_stale(row):
+                continue
+            # the readonly row cannot be modified, render into a model holding the same values
+            m = model(**row._asdict())
+            render(m)
+            seq_of_args.append([m.html_content, m.html_digest, m.getValue(model.__primary_key__)])
+        if seq_of_args and not dry_run:
+            await orm.executemany(sql, seq_of_args)
+        updated += len(seq_of_args)
+    logging.info('%s: %s rows scanned, %s rows %s' % (model.__table__, scanned, updated,
+                                                      'to render' if dry_run else 'rendered'))
+    return updated
+
+
+async def main(argv=None):
+    parser = argparse.ArgumentParser(description='store the rendered html of blogs and comments')
+    parser.add_argument('--batch', type=int, default=500, help='rows per UPDATE batch')
+    parser.add_argument('--dry-run', action='store_true', help='only count the rows to render')
+    args = parser.parse_args(argv)
+    await orm.create_pool(loop=asyncio.get_event_loop(), **configs.db)
+    try:
+        await backfill(Blog, markup.render_blog, args.batch, args.dry_run)
+        await backfill(Comment, markup.render_comment, args.batch, args.dry_run)
+    finally:
+        await orm.destroy_pool()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,82 @@
+import time, logging
+from collections import OrderedDict
+
+logging.basicConfig(level=logging.INFO)
+
+
+class LRUCache(object):
+    '''
+    A small in-process cache with LRU eviction and per-entry TTL.
+    Hit / miss / eviction counters are kept so the cache effect can be observed.
+    With weigh (i.e. len) and maxweight, the total weight of the entries is bounded too.
+    '''
+
+    def __init__(self, maxsize=1024, ttl=None, maxweight=None, weigh=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.maxweight = maxweight
+        self.weigh = weigh
+        self.weight = 0
+        # key => (value, expires, weight)
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        value, expires, weight = entry
+        if expires is not None and expires < time.time():
+            self._remove(key)
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        expires = time.time() + ttl if ttl is not None else None
+        weight = self.weigh(value) if self.weigh is not None else 0
+        if key in self._data:
+            self._remove(key)
+        self._data[key] = (value, expires, weight)
+        self.weight += weight
+        while len(self._data) > self.maxsize or (self.maxweight is not None and self.weight > self.maxweight):
+            self._remove(next(iter(self._data)))
+            self.evictions += 1
+
+    def _remove(self, key):
+        entry = self._data.pop(key)
+        self.weight -= entry[2]
+        return entry
+
+    def pop(self, key, default=None):
+        if key not in self._data:
+            return default
+        return self._remove(key)[0]
+
+    def pop_if(self, predicate):
+        # remove every entry whose (key, value) matches predicate, return the number removed
+        keys = [k for k, entry in self._data.items() if predicate(k, entry[0])]
+        for k in keys:
+            self._remove(k)
+        return len(keys)
+
+    def clear(self):
+        self._data.clear()
+        self.weight = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def stats(self):
+        return dict(size=len(self._data), maxsize=self.maxsize, ttl=self.ttl, weight=self.weight,
+                    hits=self.hits, misses=self.misses, evictions=self.evictions)
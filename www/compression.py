@@ -0,0 +1,82 @@
+import asyncio, gzip, logging, zlib
+from aiohttp import payload, web
+from assets import parse_accept_encoding
+
+logging.basicConfig(level=logging.INFO)
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# content types which are compressed already, or not worth it
+_SKIPPED_TYPES = ('image/', 'video/', 'audio/', 'font/woff', 'application/zip', 'application/gzip',
+                  'application/x-gzip', 'application/octet-stream', 'application/pdf')
+
+
+def choose_encoding(accept_encoding):
+    accepted = parse_accept_encoding(accept_encoding)
+    # preferred first
+    for encoding in ('br', 'gzip', 'deflate'):
+        if encoding == 'br' and brotli is None:
+            continue
+        if accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+
+def compress(body, encoding, level):
+    if encoding == 'br':
+        # brotli quality runs from 0 to 11, a zlib level from 1 to 9
+        return brotli.compress(body, quality=min(11, level))
+    if encoding == 'gzip':
+        return gzip.compress(body, level, mtime=0)
+    return zlib.compress(body, level)
+
+
+class Compressor(object):
+    '''
+    Compress response bodies of at least min_size bytes with the encoding accepted by the client,
+    bodies of executor_size bytes and more are compressed in the default thread pool.
+    '''
+
+    def __init__(self, enabled=True, min_size=1024, level=6, executor_size=131072):
+        self.enabled = enabled
+        self.min_size = min_size
+        self.level = level
+        self.executor_size = executor_size
+
+    def accepts(self, res):
+        if not self.enabled or not isinstance(res, web.Response) or not isinstance(res.body, bytes):
+            return False
+        if len(res.body) < self.min_size or 'Content-Encoding' in res.headers:
+            return False
+        return not res.content_type.startswith(_SKIPPED_TYPES)
+
+    def accepts_stream(self, res):
+        # a streamed body, i.e. factories.stream_json, is compressed by aiohttp while it is written
+        if not self.enabled or not isinstance(res, web.Response) or 'Content-Encoding' in res.headers:
+            return False
+        return isinstance(res.body, payload.AsyncIterablePayload)
+
+    async def compress_response(self, request, res):
+        if self.accepts_stream(res):
+            res.enable_compression()
+            res.headers['Vary'] = 'Accept-Encoding'
+            return res
+        if not self.accepts(res):
+            return res
+        encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+        if encoding is None:
+            res.headers['Vary'] = 'Accept-Encoding'
+            return res
+        body = res.body
+        if len(body) >= self.executor_size:
+            # keep the event loop serving while a large body is compressed
+            body = await asyncio.get_event_loop().run_in_executor(None, compress, body, encoding, self.level)
+        else:
+            body = compress(body, encoding, self.level)
+        res.body = body
+        res.headers['Content-Encoding'] = encoding
+        res.headers['Vary'] = 'Accept-Encoding'
+        return res
@@ -0,0 +1,113 @@
+import hashlib, logging, os
+from email.utils import formatdate, parsedate_to_datetime
+from aiohttp import web
+from assets import etag_matches
+
+logging.basicConfig(level=logging.INFO)
+
+# headers repeated in a 304 answer, as the 200 answer would have sent them
+_NOT_MODIFIED_HEADERS = ('ETag', 'Last-Modified', 'Cache-Control', 'Vary')
+
+# mixed into version_etag(), changes with the templates and static files of a deploy
+_version_salt = ''
+
+
+def set_version_salt(salt):
+    global _version_salt
+    _version_salt = salt
+
+
+def tree_version(*paths):
+    '''
+    Digest of the names, sizes and modification times of the files under paths.
+    '''
+    h = hashlib.sha1()
+    for path in paths:
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for f in sorted(files):
+                fullpath = os.path.join(root, f)
+                st = os.stat(fullpath)
+                h.update(('%s:%s:%s\n' % (os.path.relpath(fullpath, path), st.st_size, st.st_mtime)).encode('utf-8'))
+    return h.hexdigest()
+
+
+def weak_etag(body):
+    # weak, so the same tag stands for the identity and the compressed bodies
+    return 'W/"%s"' % hashlib.sha1(body).hexdigest()
+
+
+def version_etag(*parts):
+    '''
+    ETag of a response built from parts, i.e. version_etag('blog', blog.id, blog.created_at),
+    so a handler can answer 304 before it runs the full query and render, see check().
+    '''
+    s = '\n'.join([_version_salt] + [str(p) for p in parts])
+    return 'W/"v-%s"' % hashlib.sha1(s.encode('utf-8')).hexdigest()
+
+
+def http_date(t):
+    return formatdate(int(t), usegmt=True)
+
+
+def parse_http_date(s):
+    try:
+        return parsedate_to_datetime(s).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def is_conditional(request):
+    # whether a handler may answer 304, it is only worth looking up a version when it may
+    return request.method in ('GET', 'HEAD') and (
+        'If-None-Match' in request.headers or 'If-Modified-Since' in request.headers)
+
+
+def not_modified(request, etag=None, last_modified=None):
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    # If-None-Match takes precedence, If-Modified-Since is only used without it
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        return etag is not None and etag_matches(if_none_match, etag)
+    if last_modified is None:
+        return False
+    since = parse_http_date(request.headers.get('If-Modified-Since'))
+    return since is not None and int(last_modified) <= since
+
+
+def check(request, etag=None, last_modified=None):
+    '''
+    Called by a handler with the validators of the response it is about to build: raise 304 when
+    the client has that version already, otherwise they are sent with the response by validate().
+    '''
+    request.__validators__ = (etag, last_modified)
+    if not_modified(request, etag, last_modified):
+        headers = {'ETag': etag} if etag is not None else {}
+        if last_modified is not None:
+            headers['Last-Modified'] = http_date(last_modified)
+        headers['Cache-Control'] = 'no-cache'
+        raise web.HTTPNotModified(headers=headers)
+
+
+def validate(request, res):
+    '''
+    Add ETag (by default weak_etag of the body) and Last-Modified to a 200 answer of GET or HEAD,
+    return 304 instead when the request is conditional and the client has the same version.
+    '''
+    if request.method not in ('GET', 'HEAD') or res.status != 200:
+        return res
+    if not isinstance(res, web.Response) or not isinstance(res.body, bytes):
+        return res
+    etag, last_modified = getattr(request, '__validators__', (None, None))
+    if 'ETag' not in res.headers:
+        res.headers['ETag'] = etag or weak_etag(res.body)
+    if last_modified is not None and 'Last-Modified' not in res.headers:
+        res.headers['Last-Modified'] = http_date(last_modified)
+    if 'Cache-Control' not in res.headers:
+        # may be stored, but must be revalidated before it is reused
+        res.headers['Cache-Control'] = 'no-cache'
+    last_modified = res.headers.get('Last-Modified')
+    if not_modified(request, res.headers['ETag'], parse_http_date(last_modified) if last_modified else None):
+        return web.Response(status=304, headers={k: res.headers[k] for k in _NOT_MODIFIED_HEADERS if k in res.headers})
+    return res
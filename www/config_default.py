@@ -7,9 +7,107 @@ config = {
         'port': 3306,
         'username': 'change_me',
         'password': 'change_me',
-        'db': 'awesome'
+        'db': 'awesome',
+        # read replicas, i.e. [{'host': '10.0.0.2'}], missing settings are taken from the primary
+        'replicas': [],
+        # round_robin or least_busy
+        'replica_policy': 'round_robin',
+        # seconds during which the reads of a user who wrote are sent to the primary, by any worker
+        # process: the write time is carried by the awesome_wrote cookie
+        'read_your_writes': 5,
+        # replicas lagging more than replica_max_lag seconds are taken out of rotation
+        'replica_check_interval': 5,
+        'replica_max_lag': 10
+    },
+    'server': {
+        'host': '127.0.0.1',
+        'port': 8080,
+        'backlog': 128,
+        # number of worker processes, 0 for the number of CPUs
+        'workers': 0,
+        # bind one SO_REUSEPORT socket per worker instead of sharing a socket bound by the master
+        'reuse_port': True,
+        'keepalive_timeout': 75,
+        # seconds given to the requests in flight on SIGTERM
+        'shutdown_timeout': 30,
+        # uvloop is used when installed, asyncio otherwise
+        'loop': 'uvloop',
+        'max_line_size': 8190,
+        'max_field_size': 8190,
+        'access_log': True
+    },
+    'static': {
+        # serve www/static from memory with precompressed variants, from disk otherwise
+        'memory': True,
+        'max_age': 3600,
+        'gzip_level': 9,
+        # for the content-hashed urls of asset_url()
+        'immutable_max_age': 31536000
+    },
+    'compression': {
+        # gzip / brotli / deflate for dynamic responses of at least min_size bytes
+        'enabled': True,
+        'min_size': 1024,
+        'level': 6,
+        # bodies of at least executor_size bytes are compressed in a thread
+        'executor_size': 131072
+    },
+    'templates': {
+        # auto_reload off and templates compiled once into a bytecode cache on disk,
+        # set False while editing templates
+        'production': True,
+        # None for a directory in the system temp dir
+        'bytecode_cache_dir': None,
+        # html of the {% cache key, ttl %} blocks, see fragments.FragmentCacheExtension
+        'fragment_cache_size': 1000,
+        'fragment_cache_ttl': 300
+    },
+    'single_flight': {
+        # identical anonymous GETs in flight run the handler once and share the response
+        'enabled': True
+    },
+    'page_cache': {
+        # responses of anonymous GET requests to /, /blog/{id} and the blog apis, per worker process
+        'enabled': True,
+        'max_bytes': 67108864,
+        'max_entries': 10000,
+        'ttl': 60
+    },
+    'json': {
+        # auto for orjson when installed, or json / orjson
+        'backend': 'auto',
+        # dict results with at least stream_threshold list items are sent in chunks of chunk_size items
+        'stream_threshold': 1000,
+        'chunk_size': 200
+    },
+    'search': {
+        # in-process BM25 index of the blogs behind /api/search
+        'enabled': True,
+        # snapshot file loaded at startup and saved by the first worker, None for data/search.idx next to www/
+        'snapshot': None,
+        # seconds between two syncs with the blogs written by the other processes
+        'sync_interval': 30,
+        'k1': 1.2,
+        'b': 0.75
     },
     'session': {
-        'secret': 'Awesome'
+        'secret': 'Awesome',
+        # in-process cache of authenticated cookies, see handler.cookie2user, a user written by another
+        # worker process keeps its old session there for at most cache_ttl seconds
+        'cache_size': 10000,
+        'cache_ttl': 300
+    },
+    'home': {
+        'page_size': 5,
+        # number of latest blog summaries kept in memory for the home page
+        'latest_cache_size': 50,
+        # seconds before a process reloads them, the blogs written by another process show up after it
+        'latest_cache_ttl': 30
+    },
+    'slow_query': {
+        # statements slower than threshold seconds are kept in a ring buffer of size entries
+        'threshold': 0.5,
+        'size': 200,
+        'explain': True
     }
 }
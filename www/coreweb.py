@@ -32,30 +32,36 @@ class RequestHandler(object):
 
     def __init__(self, func):
         self._func = func
+        # compile the binding plan once, the call path only does dict lookups
+        params = inspect.signature(func).parameters
+        for k, arg in params.items():
+            if k == 'request' and arg.kind in (arg.VAR_POSITIONAL, arg.VAR_KEYWORD):
+                raise ValueError('request parameter cannot be the var argument in %s' % func.__name__)
+        self._arg_names = tuple(params.keys())
+        self._required_args = tuple(k for k, arg in params.items() if
+                                    arg.kind not in (arg.VAR_POSITIONAL, arg.VAR_KEYWORD) and arg.default == arg.empty)
+        self._has_request_arg = 'request' in params
 
     async def __call__(self, request):
-        required_args = inspect.signature(self._func).parameters
-        logging.info('handler function required args: %s' % required_args)
-
         # get parameters from the request
-        inbound_kw = {k: v for k, v in request.__data__.items() if k in required_args}
+        data = request.__data__
+        inbound_kw = {k: data[k] for k in self._arg_names if k in data}
 
         # get match_info, i.e. @get('/blog/{id}'), add to inbound_kw
-        inbound_kw.update(request.match_info)
+        if request.match_info:
+            inbound_kw.update(request.match_info)
 
         # If request is required by the handler, add it
-        if 'request' in required_args:
+        if self._has_request_arg:
             inbound_kw['request'] = request
 
         # check if any required argument is missing from the inbound request
-        for k, arg in required_args.items():
-            if k == 'request' and arg.kind in (arg.VAR_POSITIONAL, arg.VAR_KEYWORD):
-                return web.HTTPBadRequest(text='request parameter cannot be the var argument!')
-            if arg.kind not in (arg.VAR_POSITIONAL, arg.VAR_KEYWORD):
-                if arg.default == arg.empty and arg.name not in inbound_kw:
-                    return web.HTTPBadRequest(text='Missing argument: %s' % arg.name)
+        for k in self._required_args:
+            if k not in inbound_kw:
+                return web.HTTPBadRequest(text='Missing argument: %s' % k)
 
-        logging.info('calling handler function with args: %s' % inbound_kw)
+        if logging.root.isEnabledFor(logging.DEBUG):
+            logging.debug('calling handler function %s with args: %s' % (self._func.__name__, inbound_kw))
         try:
             return await self._func(**inbound_kw)
         except APIError as e:
@@ -77,7 +83,21 @@ def add_routes(app, module_name):
         if callable(func) and hasattr(func, '__method__') and hasattr(func, '__route__'):
             args = ','.join(inspect.signature(func).parameters.keys())
             logging.info('add route %s %s => %s(%s)' % (func.__method__, func.__route__, func.__name__, args))
-            app.router.add_route(func.__method__, func.__route__, RequestHandler(func))
+            app.router.add_route(func.__method__, func.__route__, make_handler(func))
+
+
+def make_handler(func):
+    '''
+    Wrap RequestHandler(func) in a coroutine function: aiohttp wraps any other callable in a handler
+    which asserts a web.StreamResponse is returned, before response_factory turns a dict or str into one.
+    '''
+    request_handler = RequestHandler(func)
+
+    @functools.wraps(func)
+    async def handle(request):
+        return await request_handler(request)
+
+    return handle
 
 
 def add_static(app):
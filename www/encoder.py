@@ -0,0 +1,84 @@
+import json, logging
+from decimal import Decimal
+
+logging.basicConfig(level=logging.INFO)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def default(obj):
+    '''
+    Encode the objects the json backends do not know. orm.Model is a dict and needs none:
+    it is encoded by the C encoder of both backends without calling default().
+    '''
+    # orm.Row keeps its values in slots
+    if hasattr(obj, '_asdict'):
+        return obj._asdict()
+    if isinstance(obj, Decimal):
+        return float(obj)
+    # apis.Page and apis.CursorPage
+    if hasattr(obj, '__dict__'):
+        return obj.__dict__
+    raise TypeError('Object of type %s is not JSON serializable' % obj.__class__.__name__)
+
+
+def _json_dumps(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=default).encode('utf-8')
+
+
+def _orjson_dumps(obj):
+    return orjson.dumps(obj, default=default)
+
+
+# name => function returning the utf-8 json of an object
+BACKENDS = {'json': _json_dumps}
+if orjson is not None:
+    BACKENDS['orjson'] = _orjson_dumps
+
+_dumps = _orjson_dumps if orjson is not None else _json_dumps
+
+
+def use(backend):
+    '''
+    Select the backend by name, 'auto' for orjson when installed and json otherwise.
+    '''
+    global _dumps
+    if backend == 'auto':
+        backend = 'orjson' if orjson is not None else 'json'
+    if backend not in BACKENDS:
+        raise ValueError('JSON backend not available: %s' % backend)
+    _dumps = BACKENDS[backend]
+    logging.info('json backend: %s' % backend)
+
+
+def dumps(obj):
+    return _dumps(obj)
+
+
+def count_items(obj):
+    # number of items in the lists of a dict result, i.e. the blogs of dict(page=p, blogs=blogs)
+    if not isinstance(obj, dict):
+        return 0
+    return sum(len(v) for v in obj.values() if isinstance(v, (list, tuple)))
+
+
+def iter_dumps(obj, chunk_size=200):
+    '''
+    Yield the json of the dict obj in parts, the lists are encoded chunk_size items at a time,
+    so a large result is never held as a single string.
+    '''
+    yield b'{'
+    for i, (k, v) in enumerate(obj.items()):
+        prefix = (b',' if i else b'') + _dumps(k) + b':'
+        if not isinstance(v, (list, tuple)) or len(v) <= chunk_size:
+            yield prefix + _dumps(v)
+            continue
+        yield prefix + b'['
+        for j in range(0, len(v), chunk_size):
+            # the json of a list chunk without its brackets
+            yield (b',' if j else b'') + _dumps(list(v[j:j + chunk_size]))[1:-1]
+        yield b']'
+    yield b'}'
@@ -1,9 +1,44 @@
-import asyncio, logging, json
+import asyncio, logging, time
 
 logging.basicConfig(level=logging.INFO)
 from aiohttp import web
 from urllib import parse
-from handler import COOKIE_NAME, cookie2user
+from handler import COOKIE_NAME, cookie2user, _PAGE_CACHE
+import conditional, encoder, loader, metrics, orm
+from compression import Compressor, choose_encoding
+from singleflight import SingleFlight, copy_response
+from config import configs
+
+_compressor = Compressor(**configs.compression)
+encoder.use(configs.json.backend)
+# identical anonymous GETs in flight, see single_flight_factory
+_single_flight = SingleFlight()
+metrics.gauge('http_single_flight', 'Anonymous GETs run by single_flight_factory, coalesced into a request in flight and in flight now.',
+              lambda: {(('stat', k),): v for k, v in _single_flight.stats().items()})
+
+
+async def static_factory(app, handler):
+    # answer /static/ requests from memory before the rest of the middlewares, see assets.StaticFiles
+    static_files = app.get('__static__', None)
+    if static_files is None:
+        return handler
+
+    async def serve_static(request):
+        res = static_files.serve(request)
+        if res is not None:
+            return res
+        return await handler(request)
+
+    return serve_static
+
+
+async def loader_factory(app, handler):
+    # every request has its own cache of the objects loaded by loader.find, must come before auth_factory
+    async def load(request):
+        loader.request_cache()
+        return await handler(request)
+
+    return load
 
 
 async def logger_factory(app, handler):
@@ -14,6 +49,26 @@ async def logger_factory(app, handler):
     return logger
 
 
+async def metrics_factory(app, handler):
+    async def collect(request):
+        start = time.perf_counter()
+        status = 500
+        try:
+            res = await handler(request)
+            status = res.status
+            return res
+        except web.HTTPException as e:
+            status = e.status
+            raise
+        finally:
+            # label by route template rather than path, i.e. /blog/{id}
+            route = request.match_info.route.resource
+            metrics.observe_request(request.method, route.canonical if route is not None else 'unmatched', status,
+                                    time.perf_counter() - start)
+
+    return collect
+
+
 async def data_factory(app, handler):
     async def parse_data(request):
         logging.info('data_factory')
@@ -43,6 +98,17 @@ async def data_factory(app, handler):
     return parse_data
 
 
+# last write time of the session, see orm.set_session_key()
+WRITE_COOKIE_NAME = 'awesome_wrote'
+
+
+def _parse_write_time(cookie_str):
+    try:
+        return float(cookie_str) if cookie_str else None
+    except ValueError:
+        return None
+
+
 async def auth_factory(app, handler):
     async def auth(request):
         logging.info('check user for request: %s %s' % (request.method, request.path))
@@ -54,50 +120,131 @@ async def auth_factory(app, handler):
             if user:
                 logging.info('current user: %s:%s' % (user.name, user.email))
                 request.__user__ = user
+                # read-your-writes: a user's reads go to the primary right after a write
+                orm.set_session_key(user.id, _parse_write_time(request.cookies.get(WRITE_COOKIE_NAME)))
         if request.path.startswith('/manage/') and (request.__user__ is None or not request.__user__.admin):
             return web.HTTPFound('/login')
-        return await handler(request)
+        res = await handler(request)
+        if request.__user__ is not None:
+            wrote_at = orm.session_write_time()
+            # the next request may be handled by another worker process, the client tells it about the write
+            if wrote_at is not None and isinstance(res, web.StreamResponse) and not res.prepared and \
+                    '%.3f' % wrote_at != request.cookies.get(WRITE_COOKIE_NAME):
+                res.set_cookie(WRITE_COOKIE_NAME, '%.3f' % wrote_at, max_age=configs.db.read_your_writes, httponly=True)
+        return res
 
     return auth
 
 
-async def response_factory(app, handler):
-    async def response(request):
-        logging.info('Response handler...')
+async def page_cache_factory(app, handler):
+    # replay the pages of anonymous users from handler._PAGE_CACHE, must come after auth_factory
+    async def page_cache(request):
+        tags = _PAGE_CACHE.route_tags(request)
+        if tags is None:
+            return await handler(request)
+        res = _PAGE_CACHE.get(request)
+        if res is not None:
+            return conditional.validate(request, res)
+        generation = _PAGE_CACHE.generation
         res = await handler(request)
-        if isinstance(res, web.StreamResponse):
-            return res
-        if isinstance(res, bytes):
-            final_res = web.Response(body=res)
-            final_res.content_type = 'application/octet-stream'
+        if _PAGE_CACHE.set(request, res, tags, generation):
+            res.headers['X-Cache'] = 'MISS'
+        return res
+
+    return page_cache
+
+
+async def stream_json(res):
+    # encoded chunk by chunk while aiohttp writes the previous ones
+    for chunk in encoder.iter_dumps(res, configs.json.chunk_size):
+        yield chunk
+
+
+async def single_flight_factory(app, handler):
+    # identical anonymous GETs arriving while one of them runs share its response, must come after auth_factory
+    if not configs.single_flight.enabled:
+        return handler
+
+    async def single_flight(request):
+        if request.method != 'GET' or request.__user__ is not None:
+            return await handler(request)
+        # everything which makes two answers differ: url, content encoding and validators
+        key = (request.path_qs, choose_encoding(request.headers.get('Accept-Encoding')),
+               request.headers.get('If-None-Match'), request.headers.get('If-Modified-Since'))
+
+        async def call():
+            # an HTTPException (i.e. 304 from conditional.check, 404) is also the response, a single
+            # instance raised in every waiter would be sent once, it is returned and copied instead
+            try:
+                return await handler(request)
+            except web.HTTPException as e:
+                return e
+
+        res, shared = await _single_flight.do(key, call)
+        if isinstance(res, web.HTTPException) and not shared:
+            raise res
+        copy = copy_response(res)
+        if shared and copy is None:
+            # a streamed body cannot be shared, run the request again
+            return await handler(request)
+        if shared:
+            route = request.match_info.route.resource
+            metrics.inc('http_coalesced_requests_total', 'Anonymous GETs answered by an identical request in flight.',
+                        (('route', route.canonical if route is not None else 'unmatched'),))
+        # a response object is sent once, every request gets its own
+        return copy if copy is not None else res
+
+    return single_flight
+
+
+def make_response(app, request, res):
+    # turn the result of a handler into a web.StreamResponse
+    if isinstance(res, web.StreamResponse):
+        return res
+    if isinstance(res, bytes):
+        final_res = web.Response(body=res)
+        final_res.content_type = 'application/octet-stream'
+        return final_res
+    if isinstance(res, str):
+        if res.startswith('redirect:'):
+            return web.HTTPFound(res[9:])
+        final_res = web.Response(body=res.encode('utf-8'))
+        final_res.content_type = 'text/html;charset=utf-8'
+        return final_res
+    if isinstance(res, dict):
+        template = res.get('__template__')
+        if template is None:
+            if encoder.count_items(res) >= configs.json.stream_threshold:
+                final_res = web.Response(body=stream_json(res))
+            else:
+                final_res = web.Response(body=encoder.dumps(res))
+            final_res.content_type = 'application/json;charset=utf-8'
             return final_res
-        if isinstance(res, str):
-            if res.startswith('redirect:'):
-                return web.HTTPFound(res[9:])
-            final_res = web.Response(body=res.encode('utf-8'))
+        else:
+            res['__user__'] = request.__user__
+            start = time.perf_counter()
+            body = app['__templating__'].get_template(template).render(**res).encode('utf-8')
+            metrics.observe_render(template, time.perf_counter() - start)
+            final_res = web.Response(body=body)
             final_res.content_type = 'text/html;charset=utf-8'
             return final_res
-        if isinstance(res, dict):
-            template = res.get('__template__')
-            if template is None:
-                final_res = web.Response(
-                    body=json.dumps(res, ensure_ascii=False, default=lambda x: x.__dict__).encode('utf-8'))
-                final_res.content_type = 'application/json;charset=utf-8'
-                return final_res
-            else:
-                res['__user__'] = request.__user__
-                final_res = web.Response(
-                    body=app['__templating__'].get_template(template).render(**res).encode('utf-8'))
-                final_res.content_type = 'text/html;charset=utf-8'
-                return final_res
-        if isinstance(res, int) and 100 <= res <= 600:
-            return web.Response(status=res)
-        if isinstance(res, tuple) and len(res) == 2:
-            status, message = res
-            if isinstance(status, int) and 100 <= status <= 600:
-                return web.Response(status=status, text=str(message))
-        final_res = web.Response(body=str(res).encode('utf-8'))
-        final_res.content_type = 'text/plain;charset=utf-8'
-        return final_res
+    if isinstance(res, int) and 100 <= res <= 600:
+        return web.Response(status=res)
+    if isinstance(res, tuple) and len(res) == 2:
+        status, message = res
+        if isinstance(status, int) and 100 <= status <= 600:
+            return web.Response(status=status, text=str(message))
+    final_res = web.Response(body=str(res).encode('utf-8'))
+    final_res.content_type = 'text/plain;charset=utf-8'
+    return final_res
+
+
+async def response_factory(app, handler):
+    async def response(request):
+        logging.info('Response handler...')
+        res = make_response(app, request, await handler(request))
+        # validators are computed on the identity body, a 304 has no body to compress
+        res = conditional.validate(request, res)
+        return await _compressor.compress_response(request, res)
 
     return response
@@ -0,0 +1,55 @@
+import logging
+from jinja2 import nodes
+from jinja2.ext import Extension
+from cache import LRUCache
+from config import configs
+
+logging.basicConfig(level=logging.INFO)
+
+# rendered fragment key => html, shared by the templates of the process
+_cache = LRUCache(maxsize=configs.templates.fragment_cache_size, ttl=configs.templates.fragment_cache_ttl)
+
+
+def invalidate(*keys):
+    '''
+    Drop the fragments cached as key or under key, i.e. invalidate('blog:1') drops 'blog:1:comments',
+    must be called after the data shown by the fragments is written.
+    '''
+    prefixes = tuple(k + ':' for k in keys)
+    count = _cache.pop_if(lambda k, html: k in keys or k.startswith(prefixes))
+    logging.info('invalidated %s cached fragments for %s' % (count, ', '.join(keys)))
+    return count
+
+
+def clear():
+    _cache.clear()
+
+
+def stats():
+    return _cache.stats()
+
+
+class FragmentCacheExtension(Extension):
+    '''
+    {% cache key, ttl %}...{% endcache %} renders the block once per key and reuses the html for ttl seconds,
+    the default ttl is templates.fragment_cache_ttl. The key must cover every variable used by the block,
+    data written while a page is loaded may stay in a fragment until ttl, see invalidate().
+    '''
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        if parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        else:
+            args.append(nodes.Const(None))
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render', args), [], [], body).set_lineno(lineno)
+
+    def _render(self, key, ttl, caller):
+        html = _cache.get(key)
+        if html is None:
+            html = caller()
+            _cache.set(key, html, ttl)
+        return html
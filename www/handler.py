@@ -1,9 +1,12 @@
-import asyncio, time, re, hashlib, json, logging, markdown2
+import asyncio, time, re, hashlib, logging
 from coreweb import get, post
 from aiohttp import web
-from models import User, Blog, Comment, next_id
-from apis import APIError, APIValueError, APIPermissionError, APIResourceNotFoundError, Page
+from models import User, Blog, Comment, next_id, on_user_changed
+from apis import APIError, APIValueError, APIPermissionError, APIResourceNotFoundError, Page, CursorPage
 from config import configs
+from cache import LRUCache
+from pagecache import PageCache
+import conditional, encoder, fragments, loader, markup, metrics, orm, search
 
 logging.basicConfig(level=logging.INFO)
 
@@ -12,6 +15,31 @@ _RE_SHA1 = re.compile(r'^[0-9a-f]{40}$')
 COOKIE_NAME = 'awesome'
 _COOKIE_KEY = configs.session.secret
 MAX_COOKIE_AGE = 86400
+# keyset of the list apis, matches the 'created_at desc' ordering of the offset pages
+_LIST_KEYSET = ('created_at', 'id')
+# columns fetched by the list views, the content text of a blog is only needed on its own page
+_BLOG_SUMMARY_FIELDS = ('id', 'user_id', 'user_name', 'user_image', 'name', 'summary', 'created_at')
+_COMMENT_LIST_FIELDS = ('id', 'blog_id', 'user_id', 'user_name', 'content', 'created_at')
+_USER_LIST_FIELDS = ('id', 'email', 'admin', 'name', 'image', 'created_at')
+
+# authenticated cookie => User, saves a User.find() and sha1 check per request
+_SESSION_CACHE = LRUCache(maxsize=configs.session.cache_size, ttl=configs.session.cache_ttl)
+metrics.gauge('session_cache', 'Session cache size and hit / miss / eviction counts.',
+              lambda: {(('stat', k),): v for k, v in _SESSION_CACHE.stats().items() if k in ('size', 'hits', 'misses', 'evictions')})
+
+# whole pages served to anonymous users, route => tags invalidated by the apis which write blogs and comments
+_PAGE_CACHE = PageCache({
+    '/': ('blogs',),
+    '/blog/{id}': ('blog:{id}',),
+    '/api/blogs': ('blogs',),
+    '/api/blogs/{id}': ('blog:{id}',),
+    '/api/comments': ('comments',),
+    '/api/search': ('blogs',)
+}, **configs.page_cache)
+metrics.gauge('fragment_cache', 'Template fragment cache size and hit / miss / eviction counts.',
+              lambda: {(('stat', k),): v for k, v in fragments.stats().items() if k in ('size', 'hits', 'misses', 'evictions')})
+metrics.gauge('page_cache', 'Page cache size, bytes and hit / miss / eviction counts.',
+              lambda: {(('stat', k),): v for k, v in _PAGE_CACHE.stats().items() if k != 'maxsize' and k != 'ttl'})
 
 
 def user2cookie(user, max_age):
@@ -30,9 +58,15 @@ async def cookie2user(cookie_str):
         if len(L) != 3:
             return None
         uid, expire, sha1 = L
-        if int(expire) < time.time():
+        remaining = int(expire) - time.time()
+        if remaining < 0:
             return None
-        user = await User.find(uid)
+        user = _SESSION_CACHE.get(cookie_str)
+        if user is not None:
+            # hand out a copy so a request cannot modify the cached user
+            return User(**user)
+        # the concurrent requests of a page (html, apis) are checked with one query
+        user = await loader.find(User, uid)
         if user is None:
             return None
         s = '%s-%s-%s-%s' % (user.id, user.passwd, expire, _COOKIE_KEY)
@@ -40,22 +74,63 @@ async def cookie2user(cookie_str):
             logging.warning('Invalid sha1 found, cookie may be fake!!')
             return None
         user.passwd = '**********'
+        # never keep a session in cache beyond the cookie expiration
+        _SESSION_CACHE.set(cookie_str, User(**user), ttl=min(configs.session.cache_ttl, remaining))
         return user
     except Exception as e:
         logging.exception(e)
         return None
 
 
+def invalidate_session(cookie_str):
+    # drop a single cookie from the session cache, i.e. on logout
+    if cookie_str:
+        _SESSION_CACHE.pop(cookie_str)
+
+
+@on_user_changed
+def invalidate_user_sessions(uid):
+    '''
+    Drop every cached session of the user, or of every user when uid is None, called by the
+    writes of models.User. Only the cache of this process is cleared, the other worker processes
+    drop the old session after session.cache_ttl seconds.
+    '''
+    count = _SESSION_CACHE.pop_if(lambda k, user: uid is None or user.id == uid)
+    logging.info('invalidated %s cached sessions for user %s' % (count, uid))
+    return count
+
+
 def check_admin(request):
     if not request.__user__ or not request.__user__.admin:
         raise APIPermissionError('User has no permission to create blog!')
 
 
-def text2html(text):
-    raw_lines = filter(lambda x: x.strip() != '', text.split('\n'))
-    html_lines = map(lambda line: '<p>%s</p>' % line.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;'),
-                     raw_lines)
-    return ''.join(html_lines)
+# (blog count, latest blog summaries, load time) served by the home page, None when it must be reloaded
+_latest_blogs = None
+_latest_blogs_version = 0
+
+
+async def get_latest_blogs():
+    global _latest_blogs
+    # refresh_latest_blogs() is only called in the process which wrote, the others reload after the ttl
+    if _latest_blogs is None or time.time() - _latest_blogs[2] > configs.home.latest_cache_ttl:
+        version = _latest_blogs_version
+        loaded_at = time.time()
+        num = await Blog.findNumber('count(id)')
+        blogs = await Blog.findAll(orderBy='created_at desc', limit=configs.home.latest_cache_size,
+                                   fields=_BLOG_SUMMARY_FIELDS)
+        # a blog written while loading makes this result stale already
+        if version != _latest_blogs_version:
+            return num, blogs
+        _latest_blogs = (num, blogs, loaded_at)
+    return _latest_blogs[:2]
+
+
+def refresh_latest_blogs():
+    # must be called whenever a blog is created, updated or deleted
+    global _latest_blogs, _latest_blogs_version
+    _latest_blogs = None
+    _latest_blogs_version += 1
 
 
 def get_page_index(page_str):
@@ -72,22 +147,57 @@ def get_page_index(page_str):
 
 @get('/')
 async def index(request, page='1'):
-    blogs = await Blog.findAll(orderBy='created_at desc')
+    page_index = get_page_index(page)
+    num, latest = await get_latest_blogs()
+    p = Page(item_count=num, page_index=page_index, page_size=configs.home.page_size)
+    # every blog is in latest when there are fewer than latest_cache_size, the last page included
+    if p.offset + p.limit <= len(latest) or len(latest) == num:
+        blogs = latest[p.offset:p.offset + p.limit]
+    else:
+        blogs = await Blog.findAll(orderBy='created_at desc', limit=(p.offset, p.limit), fields=_BLOG_SUMMARY_FIELDS)
     return {
         '__template__': 'blogs.html',
         'blogs': blogs,
-        'page_index': get_page_index(page)
+        'page': p,
+        'page_index': p.page_index
     }
 
 
+# columns which change whenever the blog page or the blog api answer does
+_BLOG_VERSION_FIELDS = ('created_at', 'html_digest')
+
+
+async def find_comments_version(blog_id):
+    # (count, latest created_at) of the comments of the blog, a comment added or deleted changes either
+    rs = await orm.select('SELECT count(`id`) _num_, max(`created_at`) _latest_ FROM `%s` WHERE `blog_id`=?'
+                          % Comment.__table__, [blog_id], 1)
+    return rs[0]['_num_'], rs[0]['_latest_']
+
+
+def blog_page_etag(request, blog, num, latest):
+    # the page also shows the user
+    user = request.__user__
+    return conditional.version_etag('blog.html', blog.id, blog.created_at, blog.html_digest, num, latest,
+                                    user.id if user else '', user.admin if user else '')
+
+
 @get('/blog/{id}')
-async def get_blog(id):
-    blog = await Blog.find(id)
+async def get_blog(request, *, id):
+    # the version is only looked up for a request which may be answered 304
+    if conditional.is_conditional(request):
+        version = await loader.find(Blog, id, fields=_BLOG_VERSION_FIELDS, readonly=True)
+        if version is not None:
+            num, latest = await find_comments_version(id)
+            conditional.check(request, etag=blog_page_etag(request, version, num, latest))
+    blog = await loader.find(Blog, id)
     comments = await Comment.findAll(where='blog_id=?', args=[id], orderBy='created_at desc')
-    # Convert plain text comment into html content
+    # the same etag, from the rows loaded anyway
+    conditional.check(request, etag=blog_page_etag(request, blog, len(comments),
+                                                   max(c.created_at for c in comments) if comments else None))
+    # html is rendered when written, only rows not backfilled yet are rendered here
     for c in comments:
-        c.html_content = text2html(c.content)
-    blog.html_content = markdown2.markdown(blog.content)
+        c.html_content = markup.comment_html(c)
+    blog.html_content = markup.blog_html(blog)
     return {
         '__template__': 'blog.html',
         'blog': blog,
@@ -95,39 +205,95 @@ async def get_blog(id):
     }
 
 
+def get_page_size(page_size_str):
+    try:
+        p = int(page_size_str)
+    except ValueError:
+        raise APIValueError('page_size', 'Invalid page size: %s' % page_size_str)
+    if p < 1:
+        raise APIValueError('page_size', 'Invalid page size: %s' % page_size_str)
+    return p
+
+
+async def find_cursor_page(model, cursor, page_size, fields=None):
+    # keyset pagination, '?cursor=' requests the first page, then next / prev of the returned page
+    p = CursorPage(cursor=cursor, page_size=get_page_size(page_size))
+    items = await model.findAll(keyset=_LIST_KEYSET, fields=fields, as_dicts=True, **p.query(_LIST_KEYSET))
+    return p, p.fill(items, _LIST_KEYSET)
+
+
 @get('/api/users')
-async def api_get_user(*, page='1'):
+async def api_get_user(*, page='1', page_size=10, cursor=None):
+    if cursor is not None:
+        p, users = await find_cursor_page(User, cursor, page_size, _USER_LIST_FIELDS)
+        return dict(page=p, users=users)
     page_index = get_page_index(page)
     num = await User.findNumber('count(id)')
-    p = Page(item_count=num, page_index=page_index)
+    p = Page(item_count=num, page_index=page_index, page_size=get_page_size(page_size))
     if num == 0:
         return dict(page=p, users=())
-    users = await User.findAll(orderBy='created_at desc', limit=(p.offset, p.limit))
+    users = await User.findAll(orderBy='created_at desc', limit=(p.offset, p.limit), fields=_USER_LIST_FIELDS,
+                               as_dicts=True)
     return dict(page=p, users=users)
 
 
 @get('/api/blogs')
-async def api_get_blogs(*, page='1', page_size=10):
+async def api_get_blogs(*, page='1', page_size=10, cursor=None):
+    if cursor is not None:
+        p, blogs = await find_cursor_page(Blog, cursor, page_size, _BLOG_SUMMARY_FIELDS)
+        return dict(page=p, blogs=blogs)
     page_index = get_page_index(page)
     num = await Blog.findNumber('count(id)')
-    p = Page(item_count=num, page_index=page_index, page_size=int(page_size))
+    p = Page(item_count=num, page_index=page_index, page_size=get_page_size(page_size))
     if num == 0:
         return dict(page=p, blogs=())
-    blogs = await Blog.findAll(orderBy='created_at desc', limit=(p.offset, p.limit))
+    blogs = await Blog.findAll(orderBy='created_at desc', limit=(p.offset, p.limit), fields=_BLOG_SUMMARY_FIELDS,
+                               as_dicts=True)
     return dict(page=p, blogs=blogs)
 
 
 @get('/api/comments')
-async def api_get_comments(*, page='1'):
+async def api_get_comments(*, page='1', page_size=10, cursor=None):
+    if cursor is not None:
+        p, comments = await find_cursor_page(Comment, cursor, page_size, _COMMENT_LIST_FIELDS)
+        return dict(page=p, comments=comments)
     page_index = get_page_index(page)
     num = await Comment.findNumber('count(id)')
-    p = Page(item_count=num, page_index=page_index)
+    p = Page(item_count=num, page_index=page_index, page_size=get_page_size(page_size))
     if num == 0:
         return dict(page=p, comments=())
-    comments = await Comment.findAll(orderBy='created_at desc', limit=(p.offset, p.limit))
+    comments = await Comment.findAll(orderBy='created_at desc', limit=(p.offset, p.limit),
+                                     fields=_COMMENT_LIST_FIELDS, as_dicts=True)
     return dict(page=p, comments=comments)
 
 
+# most results returned by /api/search
+MAX_SEARCH_RESULTS = 100
+
+
+@get('/api/search')
+async def api_search(*, q='', page_size=10):
+    if search.get_index() is None:
+        raise APIError('search:unavailable', 'q', 'Search is not enabled')
+    q = q.strip()
+    if not q:
+        raise APIValueError('q', 'search query cannot be empty!')
+    results = search.search(q, min(get_page_size(page_size), MAX_SEARCH_RESULTS))
+    if not results:
+        return dict(query=q, blogs=())
+    ids = [blog_id for blog_id, score in results]
+    blogs = await Blog.findAll('`id` IN (%s)' % orm.create_arg_str(len(ids)), ids, fields=_BLOG_SUMMARY_FIELDS)
+    found = {blog.id: blog for blog in blogs}
+    # in the order of the scores, a blog deleted by another process since its last sync is left out
+    L = []
+    for blog_id, score in results:
+        blog = found.get(blog_id, None)
+        if blog is not None:
+            blog.score = round(score, 4)
+            L.append(blog)
+    return dict(query=q, blogs=L)
+
+
 @get('/register')
 async def register():
     return {
@@ -163,7 +329,7 @@ async def api_register_user(*, name, email, passwd):
     r.set_cookie(name=COOKIE_NAME, value=user2cookie(user, MAX_COOKIE_AGE), max_age=MAX_COOKIE_AGE, httponly=True)
     user.passwd = '**********'
     r.content_type = 'application/json'
-    r.body = json.dumps(user, ensure_ascii=False).encode('utf-8')
+    r.body = encoder.dumps(user)
     return r
 
 
@@ -186,7 +352,7 @@ async def authenticate(*, email, passwd):
     r.set_cookie(name=COOKIE_NAME, value=user2cookie(user, MAX_COOKIE_AGE), max_age=MAX_COOKIE_AGE, httponly=True)
     user.passwd = '**********'
     r.content_type = 'application/json'
-    r.body = json.dumps(user, ensure_ascii=False).encode('utf-8')
+    r.body = encoder.dumps(user)
     return r
 
 
@@ -194,6 +360,7 @@ async def authenticate(*, email, passwd):
 async def logout(request):
     referer = request.headers.get('Referer')
     r = web.HTTPFound(referer or '/')
+    invalidate_session(request.cookies.get(COOKIE_NAME))
     r.set_cookie(COOKIE_NAME, '-deleted', max_age=0, httponly=True)
     logging.info('user logged out!')
     return r
@@ -214,13 +381,29 @@ async def api_delete_blog(request, *, id):
     blog = await Blog.find(id)
     if not blog:
         raise APIResourceNotFoundError('Blog', 'Failed to delete, blog not found')
-    await blog.remove()
+    # one connection and one commit for the blog and its comments
+    async with orm.transaction():
+        await blog.remove()
+        await Comment.deleteWhere('blog_id=?', [id])
+    refresh_latest_blogs()
+    search.remove_blog(id)
+    _PAGE_CACHE.invalidate('blogs', 'blog:%s' % id, 'comments')
+    fragments.invalidate('blog:%s' % id)
     return blog
 
 
 @get('/api/blogs/{id}')
-async def api_get_blog(id):
-    blog = await Blog.find(id)
+async def api_get_blog(request, *, id):
+    if conditional.is_conditional(request):
+        version = await loader.find(Blog, id, fields=_BLOG_VERSION_FIELDS, readonly=True)
+        if version is not None:
+            # created_at is reset by api_update_blog, so it is the modification time too
+            conditional.check(request, etag=conditional.version_etag('blog', id, version.created_at, version.html_digest),
+                              last_modified=version.created_at)
+    blog = await loader.find(Blog, id)
+    if blog is not None:
+        conditional.check(request, etag=conditional.version_etag('blog', id, blog.created_at, blog.html_digest),
+                          last_modified=blog.created_at)
     return blog
 
 
@@ -235,7 +418,11 @@ async def api_create_blog(request, *, name, summary, content):
         raise APIValueError('content', 'blog content cannot be empty!')
     blog = Blog(user_id=request.__user__.id, user_name=request.__user__.name, user_image=request.__user__.image,
                 name=name, summary=summary, content=content)
+    markup.render_blog(blog)
     await blog.save()
+    refresh_latest_blogs()
+    search.index_blog(blog)
+    _PAGE_CACHE.invalidate('blogs')
     return blog
 
 
@@ -252,7 +439,12 @@ async def api_update_blog(request, *, id, name, summary, content):
     blog.summary = summary
     blog.content = content
     blog.created_at = time.time()
+    markup.render_blog(blog)
     await blog.update()
+    refresh_latest_blogs()
+    search.index_blog(blog)
+    _PAGE_CACHE.invalidate('blogs', 'blog:%s' % id)
+    fragments.invalidate('blog:%s' % id)
     return blog
 
 
@@ -262,7 +454,10 @@ async def api_create_comments(id, request, *, content):
         raise APIValueError('content', 'comments content cannot be empty!')
     comment = Comment(blog_id=id, user_id=request.__user__.id, user_name=request.__user__.name,
                       user_image=request.__user__.image, content=content)
+    markup.render_comment(comment)
     await comment.save()
+    _PAGE_CACHE.invalidate('blog:%s' % id, 'comments')
+    fragments.invalidate('blog:%s:comments' % id)
     return comment
 
 
@@ -273,9 +468,89 @@ async def api_delete_comment(request, *, id):
     if not comment:
         raise APIResourceNotFoundError('comment', 'Failed to delete comment, comment not found!')
     await comment.remove()
+    _PAGE_CACHE.invalidate('blog:%s' % comment.blog_id, 'comments')
+    fragments.invalidate('blog:%s:comments' % comment.blog_id)
     return comment
 
 
+@get('/manage/sessions/stats')
+async def manage_session_stats():
+    return _SESSION_CACHE.stats()
+
+
+@get('/manage/page_cache/stats')
+async def manage_page_cache_stats():
+    return _PAGE_CACHE.stats()
+
+
+@get('/manage/metrics')
+async def manage_metrics():
+    # prometheus text exposition format
+    return web.Response(body=metrics.render().encode('utf-8'),
+                        headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+
+@get('/manage/slow_queries')
+async def manage_slow_queries():
+    return {
+        '__template__': 'manage_slow_queries.html'
+    }
+
+
+@get('/api/slow_queries')
+async def api_get_slow_queries(request):
+    check_admin(request)
+    slow_query_log = orm.get_slow_query_log()
+    if slow_query_log is None:
+        return dict(threshold=None, queries=())
+    return dict(threshold=slow_query_log.threshold, queries=slow_query_log.entries())
+
+
+# models which can be exported by /manage/export/{name} with the exported columns
+_EXPORTS = {
+    'blogs': (Blog, None),
+    'comments': (Comment, None),
+    'users': (User, _USER_LIST_FIELDS)
+}
+
+
+@get('/manage/export/{name}')
+async def manage_export(request, *, name, format='ndjson', batch='500'):
+    if name not in _EXPORTS:
+        raise APIResourceNotFoundError('export', 'Nothing to export for %s' % name)
+    if format not in ('ndjson', 'json'):
+        raise APIValueError('format', 'Unsupported export format: %s' % format)
+    # checked before prepare(), an error raised once the headers are sent cannot reach the client
+    try:
+        batch_size = int(batch)
+    except ValueError:
+        batch_size = 0
+    if batch_size < 1:
+        raise APIValueError('batch', 'Invalid batch size: %s' % batch)
+    model, fields = _EXPORTS[name]
+    r = web.StreamResponse()
+    r.content_type = 'application/x-ndjson' if format == 'ndjson' else 'application/json'
+    r.charset = 'utf-8'
+    r.headers['Content-Disposition'] = 'attachment; filename="%s.%s"' % (name, format)
+    await r.prepare(request)
+    # rows are written batch by batch, memory does not grow with the table
+    first = True
+    if format == 'json':
+        await r.write(b'[')
+    async for rows in model.stream(orderBy='created_at', batch=batch_size, fields=fields, as_dicts=True):
+        lines = [encoder.dumps(row) for row in rows]
+        if format == 'ndjson':
+            chunk = b'\n'.join(lines) + b'\n'
+        else:
+            chunk = (b',' if not first else b'') + b','.join(lines)
+        first = False
+        await r.write(chunk)
+    if format == 'json':
+        await r.write(b']')
+    await r.write_eof()
+    return r
+
+
 @get('/manage/')
 async def manage():
     return 'redirect:/manage/blogs'
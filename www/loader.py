@@ -0,0 +1,92 @@
+import asyncio, contextvars, logging
+import metrics, orm
+
+logging.basicConfig(level=logging.INFO)
+
+# at most this many primary keys in one WHERE ... IN (...) statement
+MAX_BATCH_SIZE = 100
+
+# (model, fields, readonly, primary) => {primary key => future} of the keys waiting for the end of the tick
+_pending = dict()
+# {(model, fields, readonly) => {primary key => future}} of the current request, see request_cache()
+_request_cache = contextvars.ContextVar('loader_cache', default=None)
+
+
+def request_cache():
+    '''
+    Give the current request its own cache of loaded objects, called by factories.loader_factory.
+    '''
+    _request_cache.set(dict())
+
+
+async def find(model, primary_key, fields=None, readonly=False):
+    '''
+    Same as model.find(primary_key, fields, readonly), but the find calls of a model made in the
+    same event loop tick, by any request, are sent as one SELECT ... WHERE pk IN (...).
+    A key is loaded once per request, the models returned are copies the caller may modify.
+    '''
+    if primary_key is None:
+        return None
+    if orm._transaction.get() is not None:
+        # the connection of a transaction cannot be shared with the batch
+        return await model.find(primary_key, fields=fields, readonly=readonly)
+    fields = tuple(fields) if fields else None
+    cache = _request_cache.get()
+    if cache is not None:
+        cache = cache.setdefault((model, fields, readonly), dict())
+        fut = cache.get(primary_key, None)
+        if fut is None:
+            fut = cache[primary_key] = _load(model, primary_key, fields, readonly)
+    else:
+        fut = _load(model, primary_key, fields, readonly)
+    try:
+        obj = await asyncio.shield(fut)
+    except Exception:
+        if cache is not None and cache.get(primary_key, None) is fut:
+            cache.pop(primary_key)
+        raise
+    if obj is None or readonly:
+        return obj
+    return model(**obj)
+
+
+def _load(model, primary_key, fields, readonly):
+    # the reads of a request which just wrote go to the primary, so they are batched apart
+    key = (model, fields, readonly, bool(orm.reads_from_primary()))
+    batch = _pending.get(key, None)
+    if batch is None:
+        batch = _pending[key] = dict()
+        asyncio.get_event_loop().call_soon(_dispatch, key)
+    fut = batch.get(primary_key, None)
+    if fut is None:
+        fut = batch[primary_key] = asyncio.get_event_loop().create_future()
+    return fut
+
+
+def _dispatch(key):
+    batch = _pending.pop(key)
+    # a task of its own in an empty context, the batch belongs to no single request
+    contextvars.Context().run(asyncio.ensure_future, _fetch(key, batch))
+
+
+async def _fetch(key, batch):
+    model, fields, readonly, primary = key
+    keys = list(batch.keys())
+    metrics.inc('db_loader_keys_total', 'Primary keys requested through loader.find by model.',
+                (('model', model.__name__),), len(keys))
+    try:
+        for chunk in orm.chunked(keys, MAX_BATCH_SIZE):
+            # the primary key is always selected, whatever the fields
+            objs = await model.findAll('`%s` IN (%s)' % (model.__primary_key__, orm.create_arg_str(len(chunk))),
+                                       chunk, fields=fields, readonly=readonly, primary=primary)
+            metrics.inc('db_loader_queries_total', 'Statements sent by loader.find by model.',
+                        (('model', model.__name__),))
+            found = {obj[model.__primary_key__]: obj for obj in objs}
+            for k in chunk:
+                fut = batch[k]
+                if not fut.done():
+                    fut.set_result(found.get(k, None))
+    except Exception as e:
+        for fut in batch.values():
+            if not fut.done():
+                fut.set_exception(e)
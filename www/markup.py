@@ -0,0 +1,63 @@
+import hashlib, logging, markdown2
+import metrics
+
+logging.basicConfig(level=logging.INFO)
+
+# bump when the rendering changes, every stored html becomes stale and is rendered again until backfilled
+RENDER_VERSION = '1-markdown2-%s' % markdown2.__version__
+
+
+def text2html(text):
+    raw_lines = filter(lambda x: x.strip() != '', text.split('\n'))
+    html_lines = map(lambda line: '<p>%s</p>' % line.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;'),
+                     raw_lines)
+    return ''.join(html_lines)
+
+
+def markdown2html(text):
+    return markdown2.markdown(text)
+
+
+def digest(content):
+    # identifies the content and the renderer the stored html was made from
+    return hashlib.sha1(('%s\n%s' % (RENDER_VERSION, content)).encode('utf-8')).hexdigest()
+
+
+def is_stale(obj):
+    return getattr(obj, 'html_content', None) is None or getattr(obj, 'html_digest', None) != digest(obj.content)
+
+
+def _render(obj, to_html):
+    obj.html_content = to_html(obj.content)
+    obj.html_digest = digest(obj.content)
+
+
+def _html(obj, to_html):
+    if not is_stale(obj):
+        return obj.html_content
+    metrics.inc('html_render_fallback_total', 'Views which rendered html missing or stale in the database.',
+                (('model', obj.__class__.__name__),))
+    return to_html(obj.content)
+
+
+def render_blog(blog):
+    '''
+    Store the html of the markdown content in the blog, must be called before the blog is saved or updated.
+    '''
+    _render(blog, markdown2html)
+
+
+def render_comment(comment):
+    '''
+    Store the html of the plain text content in the comment, must be called before the comment is saved.
+    '''
+    _render(comment, text2html)
+
+
+def blog_html(blog):
+    # stored html of the blog, rendered when missing or stale
+    return _html(blog, markdown2html)
+
+
+def comment_html(comment):
+    return _html(comment, text2html)
@@ -0,0 +1,123 @@
+import bisect, logging
+
+logging.basicConfig(level=logging.INFO)
+
+# upper bounds in seconds of the latency histograms
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram(object):
+    '''
+    A fixed-bucket histogram, observe() is one bisect and three additions.
+    '''
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        # (le, count) pairs as exposed by prometheus, the last one is +Inf
+        total = 0
+        for le, n in zip(self.buckets + (float('inf'),), self.counts):
+            total += n
+            yield le, total
+
+
+# metric name => (help, type, {labels tuple => Histogram or number})
+_metrics = dict()
+# metric name => (help, collect function returning {labels tuple => number})
+_gauges = dict()
+
+
+def _series(name, help, type):
+    metric = _metrics.get(name, None)
+    if metric is None:
+        metric = _metrics[name] = (help, type, dict())
+    return metric[2]
+
+
+def inc(name, help, labels=(), value=1):
+    series = _series(name, help, 'counter')
+    series[labels] = series.get(labels, 0) + value
+
+
+def observe(name, help, labels, value):
+    series = _series(name, help, 'histogram')
+    h = series.get(labels, None)
+    if h is None:
+        h = series[labels] = Histogram()
+    h.observe(value)
+
+
+def gauge(name, help, collect):
+    '''
+    Register a gauge read at scrape time, collect() returns a number or a dict of labels tuple => number.
+    '''
+    _gauges[name] = (help, collect)
+
+
+def observe_request(method, route, status, elapsed):
+    inc('http_requests_total', 'HTTP requests by route and status.', (('method', method), ('route', route), ('status', str(status))))
+    observe('http_request_duration_seconds', 'HTTP request latency by route.', (('method', method), ('route', route)), elapsed)
+
+
+def observe_sql(sql, elapsed, rows):
+    labels = (('sql', sql),)
+    observe('sql_query_duration_seconds', 'SQL statement latency by statement template.', labels, elapsed)
+    inc('sql_rows_total', 'Rows returned or affected by statement template.', labels, rows)
+
+
+def observe_render(template, elapsed):
+    observe('template_render_duration_seconds', 'Jinja2 render time by template.', (('template', template),), elapsed)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels, extra=()):
+    pairs = tuple(labels) + tuple(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, _escape(v)) for k, v in pairs)
+
+
+def render():
+    '''
+    Return every metric in the prometheus text exposition format.
+    '''
+    L = []
+    for name in sorted(_metrics):
+        help, type, series = _metrics[name]
+        L.append('# HELP %s %s' % (name, help))
+        L.append('# TYPE %s %s' % (name, type))
+        for labels, value in list(series.items()):
+            if type == 'histogram':
+                for le, count in value.cumulative():
+                    L.append('%s_bucket%s %s' % (name, _labels(labels, (('le', '+Inf' if le == float('inf') else repr(le)),)), count))
+                L.append('%s_sum%s %s' % (name, _labels(labels), repr(value.sum)))
+                L.append('%s_count%s %s' % (name, _labels(labels), value.count))
+            else:
+                L.append('%s%s %s' % (name, _labels(labels), value))
+    for name in sorted(_gauges):
+        help, collect = _gauges[name]
+        try:
+            values = collect()
+        except Exception as e:
+            logging.exception(e)
+            continue
+        if not isinstance(values, dict):
+            values = {(): values}
+        L.append('# HELP %s %s' % (name, help))
+        L.append('# TYPE %s gauge' % name)
+        for labels, value in values.items():
+            L.append('%s%s %s' % (name, _labels(labels), value))
+    L.append('')
+    return '\n'.join(L)
@@ -1,5 +1,19 @@
 import time,uuid
-from orm import Model, StringField, BooleanField, FloatField, TextField
+from orm import Model, StringField, BooleanField, FloatField, TextField, DEFAULT_CHUNK_SIZE
+
+# functions called with the id of a user updated or removed, None when the users are not known
+_user_listeners = []
+
+def on_user_changed(func):
+    '''
+    Register func(uid), i.e. handler.invalidate_user_sessions, so every write of a user reaches it.
+    '''
+    _user_listeners.append(func)
+    return func
+
+def _user_changed(uid):
+    for func in _user_listeners:
+        func(uid)
 
 def next_id():
     return '%015d%s000' % (int(time.time() * 1000), uuid.uuid4().hex)
@@ -16,6 +30,34 @@ class User(Model):
     image = StringField(column_type='varchar(500')
     created_at = FloatField(default_value=time.time)
 
+    # the passwd or admin flag may have changed, the cached sessions of the user must go
+    async def update(self):
+        await super().update()
+        _user_changed(self.id)
+
+    async def remove(self):
+        await super().remove()
+        _user_changed(self.id)
+
+    @classmethod
+    async def updateMany(cls, models, chunk_size=DEFAULT_CHUNK_SIZE):
+        rows = await super().updateMany(models, chunk_size)
+        for user in models:
+            _user_changed(user.id)
+        return rows
+
+    @classmethod
+    async def updateWhere(cls, values, where, args=None):
+        rows = await super().updateWhere(values, where, args)
+        _user_changed(None)
+        return rows
+
+    @classmethod
+    async def deleteWhere(cls, where, args=None):
+        rows = await super().deleteWhere(where, args)
+        _user_changed(None)
+        return rows
+
 
 class Blog(Model):
     __table__ = 'blogs'
@@ -27,6 +69,9 @@ class Blog(Model):
     name = StringField(column_type='varchar(50)')
     summary = StringField(column_type='varchar(200)')
     content = TextField()
+    # markup.render_blog() of content, html_digest tells whether html_content is still current
+    html_content = TextField(column_type='mediumtext')
+    html_digest = StringField(column_type='varchar(50)')
     created_at = FloatField(default_value=time.time)
 
 
@@ -39,4 +84,6 @@ class Comment(Model):
     user_name = StringField(column_type='varchar(50)')
     user_image = StringField(column_type='varchar(500)')
     content = TextField()
+    html_content = TextField()
+    html_digest = StringField(column_type='varchar(50)')
     created_at = FloatField(default_value=time.time)
\ No newline at end of file
@@ -1,21 +1,74 @@
 # user/bin/env python3
 # -*- coding: utf-8 -*-
 
-import asyncio, logging
+import asyncio, contextlib, contextvars, functools, logging, re, time
 
 logging.basicConfig(level=logging.INFO)
 
 import aiomysql
+import metrics
+from cache import LRUCache
+
+_pool = None
+# number of coroutines waiting for a free connection of the pool
+_waiting = 0
+# connection pinned by the current transaction(), None outside of a transaction
+_transaction = contextvars.ContextVar('transaction', default=None)
+
+
+_RE_MULTI_VALUES = re.compile(r'(\(\?(?:,\?)*\))(?:,\1)+')
+_RE_IN_LIST = re.compile(r'\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)', re.IGNORECASE)
 
 
 def log(sql, args=()):
     logging.info('SQL statement: %s' % sql)
 
 
-async def create_pool(loop, **kw):
-    logging.info('creating database connection...')
-    global _pool
-    _pool = await aiomysql.create_pool(
+# statement template used to group statements, i.e. the rows of a multi-row INSERT
+# and the keys of an IN list are folded, so each batch size is not a template of its own
+@functools.lru_cache(maxsize=1024)
+def normalize_sql(sql):
+    return _RE_IN_LIST.sub('IN (?...)', _RE_MULTI_VALUES.sub(r'\1,...', sql))
+
+
+class Replica(object):
+    '''
+    A read replica pool with its health, replication lag and connections in use.
+    '''
+
+    def __init__(self, name, pool):
+        self.name = name
+        self.pool = pool
+        self.healthy = True
+        self.lag = None
+        self.in_use = 0
+        self.waiting = 0
+        # SHOW REPLICA STATUS from MySQL 8.0.22, SHOW SLAVE STATUS before, it is gone from 8.4
+        self.status_sql = 'SHOW REPLICA STATUS'
+
+    def __str__(self):
+        return '<Replica %s healthy: %s, lag: %s, in use: %s>' % (self.name, self.healthy, self.lag, self.in_use)
+
+    __repr__ = __str__
+
+
+# read replicas, select() goes to a healthy one unless the session wrote recently
+_replicas = []
+_replica_policy = 'round_robin'
+_next_replica = 0
+_monitor = None
+# session key (i.e. the user id) of the current request, set by set_session_key()
+_session_key = contextvars.ContextVar('session_key', default=None)
+# last write time of the session, carried from request to request by the client so another
+# worker process knows it too, see set_session_key() and session_write_time()
+_wrote_at = contextvars.ContextVar('wrote_at', default=None)
+# session keys which wrote within the read-your-writes window, their reads go to the primary
+_recent_writers = LRUCache(maxsize=10000, ttl=5)
+_read_your_writes = 5
+
+
+async def _create_pool(loop, kw):
+    return await aiomysql.create_pool(
         host=kw.get('host', 'localhost'),
         port=kw.get('port', 3306),
         user=kw['username'],
@@ -29,30 +82,274 @@ async def create_pool(loop, **kw):
     )
 
 
+# kw configures the primary, kw['replicas'] is a list of replica settings overriding the primary ones
+async def create_pool(loop, **kw):
+    logging.info('creating database connection...')
+    global _pool, _replicas, _replica_policy, _recent_writers, _read_your_writes, _monitor
+    _pool = await _create_pool(loop, kw)
+    _replicas = []
+    for i, replica_kw in enumerate(kw.get('replicas', None) or ()):
+        replica_kw = dict(kw, **replica_kw)
+        name = '%s:%s' % (replica_kw.get('host', 'localhost'), replica_kw.get('port', 3306))
+        logging.info('creating replica connection %s...' % name)
+        _replicas.append(Replica(name, await _create_pool(loop, replica_kw)))
+    _replica_policy = kw.get('replica_policy', 'round_robin')
+    _read_your_writes = kw.get('read_your_writes', 5)
+    _recent_writers = LRUCache(maxsize=10000, ttl=_read_your_writes)
+    if _replicas:
+        _monitor = asyncio.ensure_future(
+            _monitor_replicas(kw.get('replica_check_interval', 5), kw.get('replica_max_lag', 10)))
+
+
 async def destroy_pool():
-    global _pool
+    global _pool, _monitor
+    if _monitor is not None:
+        _monitor.cancel()
+        _monitor = None
+    for replica in _replicas:
+        replica.pool.close()
+        await replica.pool.wait_closed()
     if _pool is not None:
         _pool.close()
         await _pool.wait_closed()
 
 
-async def select(sql, args, size=None):
+def pool_stats():
+    # pool name => connection counts
+    stats = dict()
+    if _pool is not None:
+        stats['primary'] = dict(size=_pool.size, free=_pool.freesize, maxsize=_pool.maxsize, waiting=_waiting)
+    for r in _replicas:
+        stats[r.name] = dict(size=r.pool.size, free=r.pool.freesize, maxsize=r.pool.maxsize, waiting=r.waiting)
+    return stats
+
+
+async def _monitor_replicas(interval, max_lag):
+    while True:
+        for replica in _replicas:
+            await _check_replica(replica, max_lag)
+        await asyncio.sleep(interval)
+
+
+async def _check_replica(replica, max_lag):
+    try:
+        async with replica.pool.acquire() as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cur:
+                try:
+                    await cur.execute(replica.status_sql)
+                except aiomysql.ProgrammingError:
+                    if replica.status_sql == 'SHOW SLAVE STATUS':
+                        raise
+                    # a server older than 8.0.22
+                    replica.status_sql = 'SHOW SLAVE STATUS'
+                    await cur.execute(replica.status_sql)
+                status = await cur.fetchone()
+        if status is None:
+            # not replicating from anything, i.e. a replica entry pointing to the primary
+            lag = 0
+        else:
+            lag = status.get('Seconds_Behind_Source', status.get('Seconds_Behind_Master', None))
+        healthy = lag is not None and lag <= max_lag
+    except Exception as e:
+        logging.warning('replica %s check failed: %s' % (replica.name, e))
+        lag, healthy = None, False
+    if healthy != replica.healthy:
+        logging.warning('replica %s %s rotation, lag: %s' % (replica.name, 'back in' if healthy else 'out of', lag))
+    replica.lag = lag
+    replica.healthy = healthy
+
+
+def set_session_key(key, wrote_at=None):
+    '''
+    Bind the current request to a session key, reads following a write of the same key
+    within the read-your-writes window are sent to the primary. The writes are remembered by
+    the process, wrote_at is the last write time of the session known by the client, so the
+    window holds when the write and the next read are handled by different worker processes.
+    '''
+    _session_key.set(key)
+    _wrote_at.set(wrote_at)
+
+
+def session_write_time():
+    # last write time of the session, to be sent back to the client when it changed
+    return _wrote_at.get()
+
+
+def _note_write():
+    key = _session_key.get()
+    if key is not None and _replicas:
+        _recent_writers.set(key, True)
+        _wrote_at.set(time.time())
+
+
+def _wrote_recently(key):
+    if key is None:
+        return False
+    if _recent_writers.get(key, False):
+        return True
+    wrote_at = _wrote_at.get()
+    # a time in the future is not trusted, it would pin the session to the primary
+    return wrote_at is not None and 0 <= time.time() - wrote_at < _read_your_writes
+
+
+def reads_from_primary():
+    '''
+    Whether the reads of the current request must go to the primary, i.e. in a transaction or right after a write.
+    '''
+    if _transaction.get() is not None:
+        return True
+    return _wrote_recently(_session_key.get())
+
+
+def _choose_replica():
+    if _wrote_recently(_session_key.get()):
+        return None
+    healthy = [r for r in _replicas if r.healthy]
+    if not healthy:
+        return None
+    if _replica_policy == 'least_busy':
+        return min(healthy, key=lambda r: r.in_use + r.waiting)
+    global _next_replica
+    _next_replica += 1
+    return healthy[_next_replica % len(healthy)]
+
+
+# SlowQueryLog receiving the statements slower than its threshold, see set_slow_query_log()
+_slow_query_log = None
+
+
+def set_slow_query_log(slow_query_log):
+    global _slow_query_log
+    _slow_query_log = slow_query_log
+
+
+def get_slow_query_log():
+    return _slow_query_log
+
+
+# EXPLAIN tasks in flight, see _observe()
+_explain_tasks = set()
+
+
+def _observe(sql, args, start, rows):
+    elapsed = time.perf_counter() - start
+    template = normalize_sql(sql)
+    metrics.observe_sql(template, elapsed, rows)
+    if _slow_query_log is not None and elapsed >= _slow_query_log.threshold:
+        _slow_query_log.record(template, args, elapsed, rows)
+        if _slow_query_log.need_explain(template) and sql.lstrip()[:6].upper() in ('SELECT', 'UPDATE', 'DELETE', 'INSERT'):
+            task = asyncio.ensure_future(_explain(template, sql, args))
+            # the loop only keeps a weak reference to a task, it could be collected while running
+            _explain_tasks.add(task)
+            task.add_done_callback(_explain_tasks.discard)
+
+
+async def _explain(template, sql, args):
+    # run outside of select() so the EXPLAIN is neither timed nor logged as slow itself,
+    # and outside of the transaction of the caller, this task only has a copy of its context
+    _transaction.set(None)
+    try:
+        async with connection() as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cur:
+                await cur.execute('EXPLAIN ' + sql.replace('?', '%s'), args or ())
+                rs = await cur.fetchall()
+        _slow_query_log.set_explain(template, rs)
+    except Exception as e:
+        logging.warning('failed to explain %s: %s' % (template, e))
+
+
+metrics.gauge('db_pool_connections', 'aiomysql pool connections by pool and state.',
+              lambda: {(('pool', name), ('state', k)): v for name, stats in pool_stats().items() for k, v in stats.items()})
+metrics.gauge('db_replica_healthy', 'Whether the replica is in the read rotation.',
+              lambda: {(('pool', r.name),): int(r.healthy) for r in _replicas})
+metrics.gauge('db_replica_lag_seconds', 'Replication lag of the replica, -1 when unknown.',
+              lambda: {(('pool', r.name),): -1 if r.lag is None else r.lag for r in _replicas})
+
+
+# readonly connections come from a replica when one is available
+@contextlib.asynccontextmanager
+async def connection(readonly=False):
+    conn = _transaction.get()
+    if conn is not None:
+        yield conn
+        return
+    replica = _choose_replica() if readonly and _replicas else None
+    if replica is not None:
+        replica.waiting += 1
+        try:
+            conn = await replica.pool.acquire()
+        except aiomysql.OperationalError as e:
+            # the monitor puts it back in rotation once it answers again
+            logging.warning('replica %s is down, using the primary: %s' % (replica.name, e))
+            replica.healthy = False
+        finally:
+            replica.waiting -= 1
+        if conn is not None:
+            replica.in_use += 1
+            try:
+                yield conn
+            finally:
+                replica.in_use -= 1
+                replica.pool.release(conn)
+            return
+    global _waiting
+    _waiting += 1
+    try:
+        conn = await _pool.acquire()
+    finally:
+        _waiting -= 1
+    try:
+        yield conn
+    finally:
+        _pool.release(conn)
+
+
+@contextlib.asynccontextmanager
+async def transaction():
+    '''
+    Run every select / execute / Model call of the block on one connection and commit once at
+    the end, or rollback if the block raises. A nested transaction() joins the outer one.
+    The statements of a transaction must not run concurrently, i.e. with asyncio.gather().
+    '''
+    if _transaction.get() is not None:
+        yield
+        return
+    async with connection() as conn:
+        await conn.begin()
+        token = _transaction.set(conn)
+        try:
+            yield
+            await conn.commit()
+        except BaseException:
+            await conn.rollback()
+            raise
+        finally:
+            _transaction.reset(token)
+
+
+# rows are dicts, or plain tuples in the column order of the statement when as_tuples is True
+# primary=True reads from the primary even when replicas are configured
+async def select(sql, args, size=None, as_tuples=False, primary=False):
     log(sql, args)
-    global _pool
-    async with _pool.get() as conn:
-        async with conn.cursor(aiomysql.DictCursor) as cur:
+    async with connection(readonly=not primary) as conn:
+        start = time.perf_counter()
+        async with conn.cursor(aiomysql.Cursor if as_tuples else aiomysql.DictCursor) as cur:
             await cur.execute(sql.replace('?', '%s'), args or ())
             if size:
                 rs = await cur.fetchmany(size)
             else:
                 rs = await cur.fetchall()
+        _observe(sql, args, start, len(rs))
         logging.info('row returned: %s' % len(rs))
         return rs
 
 
 async def execute(sql, args, autocommit=True):
     log(sql, args)
-    async with _pool.get() as conn:
+    async with connection() as conn:
+        start = time.perf_counter()
+        # inside a transaction() the commit happens when the transaction ends
+        autocommit = autocommit or _transaction.get() is not None
         if not autocommit:
             await conn.begin()
         try:
@@ -66,9 +363,66 @@ async def execute(sql, args, autocommit=True):
             if not autocommit:
                 await conn.rollback()
             raise
+        _note_write()
+        _observe(sql, args, start, affected_row_count)
+        return affected_row_count
+
+
+# yield lists of at most batch rows from an unbuffered server-side cursor, the connection
+# is held until the generator is exhausted or closed
+async def stream(sql, args, batch=500, as_tuples=False):
+    log(sql, args)
+    rows = 0
+    start = time.perf_counter()
+    async with connection(readonly=True) as conn:
+        async with conn.cursor(aiomysql.SSCursor if as_tuples else aiomysql.SSDictCursor) as cur:
+            await cur.execute(sql.replace('?', '%s'), args or ())
+            while True:
+                rs = await cur.fetchmany(batch)
+                if not rs:
+                    break
+                rows += len(rs)
+                yield rs
+    # not reported to the slow query log, the elapsed time includes the consumer
+    metrics.observe_sql(normalize_sql(sql), time.perf_counter() - start, rows)
+    logging.info('row streamed: %s' % rows)
+
+
+async def executemany(sql, seq_of_args, autocommit=True):
+    log(sql)
+    async with connection() as conn:
+        start = time.perf_counter()
+        # inside a transaction() the commit happens when the transaction ends
+        autocommit = autocommit or _transaction.get() is not None
+        if not autocommit:
+            await conn.begin()
+        try:
+            async with conn.cursor(aiomysql.DictCursor) as cur:
+                await cur.executemany(sql.replace('?', '%s'), seq_of_args)
+                affected_row_count = cur.rowcount
+                if not autocommit:
+                    await conn.commit()
+        except BaseException:
+            if not autocommit:
+                await conn.rollback()
+            raise
+        _note_write()
+        _observe(sql, seq_of_args[0] if seq_of_args else (), start, affected_row_count)
         return affected_row_count
 
 
+# split items into lists of at most size items
+def chunked(items, size):
+    if size < 1:
+        raise ValueError('Invalid chunk size %s' % size)
+    items = list(items)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+# default number of rows written per statement by the bulk operations of Model
+DEFAULT_CHUNK_SIZE = 500
+
+
 # Base Field class
 class Field(object):
     def __init__(self, name, column_type, is_primary_key, default_value):
@@ -117,6 +471,89 @@ def create_arg_str(num):
     return ','.join(L)
 
 
+# create keyset condition for sql, i.e, input keys=('a', 'b'), op='<', return '(`a`<?) OR (`a`=? AND `b`<?)'
+def create_keyset_condition(keys, values, op):
+    L = []
+    args = []
+    for i, k in enumerate(keys):
+        cond = ['`%s`=?' % x for x in keys[:i]]
+        cond.append('`%s`%s?' % (k, op))
+        L.append('(%s)' % ' AND '.join(cond))
+        args.extend(values[:i])
+        args.append(values[i])
+    return ' OR '.join(L), args
+
+
+# (row class, columns) => subclass of the row class for the rows of that projection
+_row_projections = dict()
+
+
+def dictsFromTuples(columns, rs):
+    # plain dicts are encoded by the C code of orjson and json, a Row goes through encoder.default()
+    return [dict(zip(columns, r)) for r in rs]
+
+
+class Row(object):
+    '''
+    Base class of the read-only rows generated for each model as Model.__row__. A row keeps
+    its values in slots instead of a dict and supports the item access of Model.
+    '''
+    __slots__ = ()
+    # columns set in the rows, the rows of each projection get their own subclass, see fromTuples
+    __columns__ = ()
+
+    @classmethod
+    def withColumns(cls, columns):
+        columns = tuple(columns)
+        if cls.__columns__ == columns:
+            return cls
+        key = (cls, columns)
+        sub = _row_projections.get(key, None)
+        if sub is None:
+            base = cls.__bases__[0] if cls.__columns__ else cls
+            sub = _row_projections[key] = type(base.__name__, (base,), dict(__slots__=(), __columns__=columns))
+        return sub
+
+    @classmethod
+    def fromTuples(cls, columns, rs):
+        cls = cls.withColumns(columns)
+        # fill the slots through their descriptors, bypassing the read-only __setattr__
+        setters = [getattr(cls, c).__set__ for c in columns]
+        new = object.__new__
+        L = []
+        for r in rs:
+            row = new(cls)
+            for setter, value in zip(setters, r):
+                setter(row, value)
+            L.append(row)
+        return L
+
+    def __setattr__(self, key, value):
+        raise AttributeError('\'%s\' object is read-only' % self.__class__.__name__)
+
+    def __getitem__(self, key):
+        if key in self.__columns__:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self.__columns__
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.__columns__ else default
+
+    def keys(self):
+        return list(self.__columns__)
+
+    def _asdict(self):
+        return {k: getattr(self, k) for k in self.__columns__}
+
+    def __str__(self):
+        return '<%s %s>' % (self.__class__.__name__, self._asdict())
+
+    __repr__ = __str__
+
+
 class ModelMetaclass(type):
     def __new__(cls, name, bases, attrs):
         # for base class 'Model', do nothing
@@ -155,6 +592,9 @@ class ModelMetaclass(type):
         attrs['__update__'] = 'UPDATE `%s` SET %s WHERE `%s`=?' % (
             table_name, ', '.join(map(lambda f: '`%s`=?' % (mappings.get(f).name or f), fields)), primary_key)
         attrs['__delete__'] = 'DELETE FROM %s WHERE `%s`=?' % (table_name, primary_key)
+        # (SELECT statement, selected columns) of column subsets, filled by Model.getSelect()
+        attrs['__projections__'] = dict()
+        attrs['__row__'] = type('%sRow' % name, (Row,), dict(__slots__=tuple([primary_key] + fields)))
         return super(ModelMetaclass, cls).__new__(cls, name, bases, attrs)
 
 
@@ -184,16 +624,68 @@ class Model(dict, metaclass=ModelMetaclass):
                 setattr(self, key, value)
         return value
 
+    # return the SELECT statement for a subset of the columns, the primary key is always selected
+    @classmethod
+    def getSelect(cls, fields=None):
+        return cls._projection(fields)[0]
+
+    # return the columns selected by getSelect(fields), in order
+    @classmethod
+    def getColumns(cls, fields=None):
+        return cls._projection(fields)[1]
+
+    @classmethod
+    def _projection(cls, fields):
+        key = tuple(fields) if fields else ()
+        projection = cls.__projections__.get(key, None)
+        if projection is None:
+            if not key:
+                projection = (cls.__select__, [cls.__primary_key__] + cls.__fields__)
+            else:
+                for f in key:
+                    if f not in cls.__mappings__:
+                        raise ValueError('Unknown field %s for model %s' % (f, cls.__name__))
+                columns = [cls.__primary_key__] + [f for f in key if f != cls.__primary_key__]
+                sql = 'SELECT %s FROM %s' % (','.join(map(lambda f: '`%s`' % f, columns)), cls.__table__)
+                projection = (sql, columns)
+            cls.__projections__[key] = projection
+        return projection
+
     # find objects with SQL WHERE clause
+    # readonly=True returns compact, read-only __row__ objects instead of models
+    # as_dicts=True returns plain dicts of the selected columns, the cheapest to build and to encode as json
+    # primary=True reads from the primary, see reads_from_primary()
+    # keyset pagination: findAll(keyset=('created_at', 'id'), after=(t, id), limit=n) returns the n rows
+    # following (or with before=..., preceding) the given key values, whatever the depth of the page
     @classmethod
     async def findAll(cls, where=None, args=None, **kw):
-        sql = [cls.__select__]
+        fields = kw.get('fields', None)
+        args = list(args) if args else []
+        orderBy = kw.get('orderBy', None)
+        keyset = kw.get('keyset', None)
+        forward = True
+        if keyset:
+            if fields:
+                # the keyset columns are needed to build the next cursor
+                fields = tuple(fields) + tuple(k for k in keyset if k not in fields)
+            desc = kw.get('desc', True)
+            after, before = kw.get('after', None), kw.get('before', None)
+            if after is not None and before is not None:
+                raise ValueError('Cannot page with both after and before')
+            forward = before is None
+            descending = desc == forward
+            seek = before if after is None else after
+            if seek is not None:
+                if len(seek) != len(keyset):
+                    raise ValueError('Invalid keyset value %s' % str(seek))
+                cond, cond_args = create_keyset_condition(keyset, seek, '<' if descending else '>')
+                where = '(%s) AND (%s)' % (where, cond) if where else cond
+                args.extend(cond_args)
+            orderBy = ', '.join(map(lambda k: '`%s` %s' % (k, 'desc' if descending else 'asc'), keyset))
+        sql = [cls.getSelect(fields)]
         if where:
             sql.append('WHERE')
             sql.append(where)
-        if args is None:
-            args = []
-        orderBy = kw.get('orderBy', None)
         if orderBy:
             sql.append('ORDER BY')
             sql.append(orderBy)
@@ -208,9 +700,45 @@ class Model(dict, metaclass=ModelMetaclass):
                 args.extend(limit)
             else:
                 raise ValueError('Invalid limit value %s' % str(limit))
-        rs = await select(' '.join(sql), args)
+        readonly = kw.get('readonly', False)
+        as_dicts = kw.get('as_dicts', False)
+        rs = await select(' '.join(sql), args, as_tuples=readonly or as_dicts, primary=kw.get('primary', False))
+        if not forward:
+            # rows of a 'before' page are fetched in reverse order
+            rs = list(reversed(rs))
+        if as_dicts:
+            return dictsFromTuples(cls.getColumns(fields), rs)
+        if readonly:
+            return cls.__row__.fromTuples(cls.getColumns(fields), rs)
         return [cls(**r) for r in rs]
 
+    # iterate over every matching object with constant memory, i.e.
+    # async for comments in Comment.stream('blog_id=?', [id], batch=1000): ...
+    @classmethod
+    async def stream(cls, where=None, args=None, batch=500, **kw):
+        fields = kw.get('fields', None)
+        readonly = kw.get('readonly', False)
+        as_dicts = kw.get('as_dicts', False)
+        sql = [cls.getSelect(fields)]
+        if where:
+            sql.append('WHERE')
+            sql.append(where)
+        orderBy = kw.get('orderBy', None)
+        if orderBy:
+            sql.append('ORDER BY')
+            sql.append(orderBy)
+        columns = cls.getColumns(fields)
+        batches = stream(' '.join(sql), args, batch, as_tuples=readonly or as_dicts)
+        try:
+            async for rs in batches:
+                if as_dicts:
+                    yield dictsFromTuples(columns, rs)
+                else:
+                    yield cls.__row__.fromTuples(columns, rs) if readonly else [cls(**r) for r in rs]
+        finally:
+            # release the connection even when the caller stops early
+            await batches.aclose()
+
     @classmethod
     async def findNumber(cls, selectFields, where=None, args=None):
         sql = ['SELECT %s _num_ FROM %s' % (selectFields, cls.__table__)]
@@ -223,12 +751,81 @@ class Model(dict, metaclass=ModelMetaclass):
         return rs[0]['_num_']
 
     @classmethod
-    async def find(cls, primary_key):
-        rs = await select('%s WHERE `%s`=?' % (cls.__select__, cls.__primary_key__), [primary_key], 1)
+    async def find(cls, primary_key, fields=None, readonly=False):
+        rs = await select('%s WHERE `%s`=?' % (cls.getSelect(fields), cls.__primary_key__), [primary_key], 1,
+                          as_tuples=readonly)
         if len(rs) == 0:
             return None
+        if readonly:
+            return cls.__row__.fromTuples(cls.getColumns(fields), rs)[0]
         return cls(**rs[0])
 
+    # insert models with multi-row INSERT statements, one statement (and one commit) per chunk
+    @classmethod
+    async def saveMany(cls, models, chunk_size=DEFAULT_CHUNK_SIZE):
+        total = 0
+        row_args = '(%s)' % create_arg_str(len(cls.__fields__) + 1)
+        for i, chunk in enumerate(chunked(models, chunk_size)):
+            args = []
+            for model in chunk:
+                args.extend(map(model.getValueOrDefault, cls.__fields__))
+                args.append(model.getValueOrDefault(cls.__primary_key__))
+            sql = cls.__insert__ + (',' + row_args) * (len(chunk) - 1)
+            rows = await execute(sql, args, autocommit=False)
+            cls._reportChunk('insert', i, len(chunk), rows)
+            total += rows
+        return total
+
+    # update models by primary key with executemany, one commit per chunk
+    @classmethod
+    async def updateMany(cls, models, chunk_size=DEFAULT_CHUNK_SIZE):
+        total = 0
+        for i, chunk in enumerate(chunked(models, chunk_size)):
+            seq_of_args = []
+            for model in chunk:
+                missing = [f for f in cls.__fields__ if f not in model]
+                if missing:
+                    raise ValueError('Cannot update %s, fields not loaded: %s' % (cls.__name__, ', '.join(missing)))
+                args = list(map(model.getValueOrDefault, cls.__fields__))
+                args.append(model.getValueOrDefault(cls.__primary_key__))
+                seq_of_args.append(args)
+            rows = await executemany(cls.__update__, seq_of_args, autocommit=False)
+            cls._reportChunk('update', i, len(chunk), rows)
+            total += rows
+        return total
+
+    # set-based UPDATE, i.e. Comment.updateWhere(dict(user_name='x'), 'user_id=?', [uid])
+    @classmethod
+    async def updateWhere(cls, values, where, args=None):
+        if not values:
+            raise ValueError('Nothing to update')
+        for k in values:
+            if k not in cls.__fields__:
+                raise ValueError('Unknown field %s for model %s' % (k, cls.__name__))
+        sql = 'UPDATE `%s` SET %s WHERE %s' % (
+            cls.__table__, ', '.join(map(lambda k: '`%s`=?' % k, values)), where)
+        rows = await execute(sql, list(values.values()) + list(args or []))
+        logging.info('update %s where %s, affected rows: %s' % (cls.__table__, where, rows))
+        return rows
+
+    # set-based DELETE, the where clause is required so a whole table cannot be wiped by mistake
+    @classmethod
+    async def deleteWhere(cls, where, args=None):
+        if not where:
+            raise ValueError('Missing where clause to delete from %s' % cls.__table__)
+        rows = await execute('DELETE FROM `%s` WHERE %s' % (cls.__table__, where), list(args or []))
+        logging.info('delete from %s where %s, affected rows: %s' % (cls.__table__, where, rows))
+        return rows
+
+    @classmethod
+    def _reportChunk(cls, action, index, expected, rows):
+        # MySQL reports 0 for an update which does not change the row, so only a warning
+        if rows != expected:
+            logging.warning('%s %s chunk %s: affected rows %s, expected %s' % (
+                action, cls.__table__, index, rows, expected))
+        else:
+            logging.info('%s %s chunk %s: affected rows %s' % (action, cls.__table__, index, rows))
+
     async def save(self):
         args = list(map(self.getValueOrDefault, self.__fields__))
         args.append(self.getValueOrDefault(self.__primary_key__))
@@ -238,6 +835,10 @@ class Model(dict, metaclass=ModelMetaclass):
             logging.error('Failed to insert record, affected rows: %s' % rows)
 
     async def update(self):
+        # a model loaded with a subset of fields would overwrite the missing columns
+        missing = [f for f in self.__fields__ if f not in self]
+        if missing:
+            raise ValueError('Cannot update %s, fields not loaded: %s' % (self.__class__.__name__, ', '.join(missing)))
         args = list(map(self.getValueOrDefault, self.__fields__))
         args.append(self.getValueOrDefault(self.__primary_key__))
         rows = await execute(self.__update__, args)
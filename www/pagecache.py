@@ -0,0 +1,78 @@
+import logging
+from aiohttp import web
+from cache import LRUCache
+from compression import choose_encoding
+
+logging.basicConfig(level=logging.INFO)
+
+# headers which belong to a single response and are never replayed from the cache
+_SKIPPED_HEADERS = ('Date', 'Set-Cookie', 'Content-Length', 'X-Cache')
+
+
+class PageCache(object):
+    '''
+    Whole responses of anonymous GET requests, bounded by max_bytes of body with LRU eviction and ttl.
+    Only the routes given in tags are cached, each entry is tagged i.e. 'blog:{id}' so a write drops
+    exactly the pages it changes with invalidate().
+    '''
+
+    def __init__(self, tags, enabled=True, max_bytes=67108864, max_entries=10000, ttl=60):
+        # route template => tag templates filled from match_info, i.e. '/blog/{id}' => ('blog:{id}',)
+        self.tags = tags
+        self.enabled = enabled
+        self._cache = LRUCache(maxsize=max_entries, ttl=ttl, maxweight=max_bytes, weigh=lambda entry: len(entry[2]))
+        # bumped by invalidate(), a page rendered across an invalidation is not stored
+        self.generation = 0
+
+    def route_tags(self, request):
+        # tags of the page at request, None when the route is not cached
+        if not self.enabled or request.method != 'GET' or request.__user__ is not None:
+            return None
+        route = request.match_info.route.resource
+        if route is None:
+            return None
+        templates = self.tags.get(route.canonical, None)
+        if templates is None:
+            return None
+        return frozenset(t.format(**request.match_info) for t in templates)
+
+    def key(self, request):
+        # a compressed and an identity body are separate entries, see compression.Compressor
+        return (request.path_qs, choose_encoding(request.headers.get('Accept-Encoding')))
+
+    def get(self, request):
+        entry = self._cache.get(self.key(request))
+        if entry is None:
+            return None
+        status, headers, body, tags = entry
+        res = web.Response(status=status, body=body, headers=headers)
+        res.headers['X-Cache'] = 'HIT'
+        return res
+
+    def set(self, request, res, tags, generation):
+        if generation != self.generation or res.status != 200:
+            return False
+        # the cookies of set_cookie() only become a Set-Cookie header in prepare(), they belong to one client
+        if not isinstance(res, web.Response) or not isinstance(res.body, bytes) or res.cookies \
+                or 'Set-Cookie' in res.headers:
+            return False
+        headers = [(k, v) for k, v in res.headers.items() if k not in _SKIPPED_HEADERS]
+        self._cache.set(self.key(request), (res.status, headers, res.body, tags))
+        return True
+
+    def invalidate(self, *tags):
+        '''
+        Drop every page tagged with one of tags, must be called after the data of the pages is written.
+        '''
+        self.generation += 1
+        tags = frozenset(tags)
+        count = self._cache.pop_if(lambda k, entry: not tags.isdisjoint(entry[3]))
+        logging.info('invalidated %s cached pages for %s' % (count, ', '.join(sorted(tags))))
+        return count
+
+    def clear(self):
+        self.generation += 1
+        self._cache.clear()
+
+    def stats(self):
+        return self._cache.stats()
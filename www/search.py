@@ -0,0 +1,340 @@
+import asyncio, base64, heapq, json, logging, math, os, re, stat, sys, time
+from array import array
+from collections import Counter
+from models import Blog
+import metrics
+
+logging.basicConfig(level=logging.INFO)
+
+# a run of CJK characters has no spaces, it is indexed as overlapping bigrams
+_RE_TOKEN = re.compile(r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]+|[^\W_\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]+')
+_RE_CJK = re.compile(r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]')
+
+# a term of the name counts as much as 3 terms of the content
+FIELD_WEIGHTS = (('name', 3), ('summary', 2), ('content', 1))
+_FIELDS = ('name', 'summary', 'content', 'created_at')
+# snapshot format, a json document which holds no code, the arrays are base64 of their machine bytes
+SNAPSHOT_VERSION = 2
+# default directory of the snapshot, owned by the app and not shared with other users like the temp dir
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+# seconds before the watermark looked at again by sync(), a blog may be committed after a newer one
+SYNC_WINDOW = 60
+
+
+def tokenize(text):
+    tokens = []
+    for t in _RE_TOKEN.findall((text or '').lower()):
+        if _RE_CJK.match(t) and len(t) > 1:
+            tokens.extend(t[i:i + 2] for i in range(len(t) - 1))
+        else:
+            tokens.append(t)
+    return tokens
+
+
+class SearchIndex(object):
+    '''
+    Inverted index of the blogs ranked with BM25. Each blog gets a document number, the postings
+    of a term are an array of (document number, weighted term frequency) pairs sorted by number.
+    '''
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        # term => array('I') of doc, tf, doc, tf...
+        self.postings = dict()
+        # document number => blog id, None once removed
+        self.ids = []
+        # document number => weighted length
+        self.lengths = array('I')
+        # blog id => (document number, terms of the document, created_at)
+        self.docs = dict()
+        self.total_length = 0
+        # created_at of the latest blog indexed, blogs written after it are picked up by sync()
+        self.watermark = 0.0
+
+    def __len__(self):
+        return len(self.docs)
+
+    def add(self, blog):
+        self.remove(blog.id)
+        counts = Counter()
+        for field, weight in FIELD_WEIGHTS:
+            for t in tokenize(blog.get(field, None)):
+                counts[t] += weight
+        doc = len(self.ids)
+        self.ids.append(blog.id)
+        length = sum(counts.values())
+        self.lengths.append(length)
+        self.total_length += length
+        for t, tf in counts.items():
+            postings = self.postings.get(t, None)
+            if postings is None:
+                postings = self.postings[t] = array('I')
+            # document numbers only grow, appending keeps the postings sorted
+            postings.append(doc)
+            postings.append(tf)
+        created_at = blog.get('created_at', None) or 0.0
+        self.docs[blog.id] = (doc, tuple(counts), created_at)
+        self.watermark = max(self.watermark, created_at)
+
+    def indexed(self, blog):
+        # whether this version of the blog is in the index already
+        entry = self.docs.get(blog.id, None)
+        return entry is not None and entry[2] == blog.created_at
+
+    def remove(self, blog_id):
+        entry = self.docs.pop(blog_id, None)
+        if entry is None:
+            return False
+        doc, terms, created_at = entry
+        for t in terms:
+            postings = self.postings[t]
+            # binary search of the pair of doc, document numbers are at the even positions
+            lo, hi = 0, len(postings) // 2
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if postings[mid * 2] < doc:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            del postings[lo * 2:lo * 2 + 2]
+            if not postings:
+                del self.postings[t]
+        self.ids[doc] = None
+        self.total_length -= self.lengths[doc]
+        self.lengths[doc] = 0
+        return True
+
+    def search(self, query, limit=10):
+        # return [(blog id, score)] of the best limit blogs
+        n = len(self.docs)
+        if n == 0:
+            return []
+        avgdl = self.total_length / n or 1.0
+        k1, b, lengths = self.k1, self.b, self.lengths
+        scores = dict()
+        for t in set(tokenize(query)):
+            postings = self.postings.get(t, None)
+            if postings is None:
+                continue
+            df = len(postings) // 2
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for i in range(0, len(postings), 2):
+                doc, tf = postings[i], postings[i + 1]
+                norm = k1 * (1 - b + b * lengths[doc] / avgdl)
+                scores[doc] = scores.get(doc, 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+        best = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+        return [(self.ids[doc], score) for doc, score in best]
+
+    def compact(self):
+        # renumber the documents so the removed ones take no room, i.e. before a snapshot
+        index = SearchIndex(self.k1, self.b)
+        renumber = dict()
+        for doc, blog_id in enumerate(self.ids):
+            if blog_id is not None:
+                renumber[doc] = len(index.ids)
+                index.ids.append(blog_id)
+                index.lengths.append(self.lengths[doc])
+        for t, postings in self.postings.items():
+            index.postings[t] = array('I', [renumber[x] if i % 2 == 0 else x for i, x in enumerate(postings)])
+        index.docs = {blog_id: (renumber[entry[0]],) + entry[1:] for blog_id, entry in self.docs.items()}
+        index.total_length = self.total_length
+        index.watermark = self.watermark
+        return index
+
+    def copy(self):
+        # copy of the index a thread can read while this one changes, the arrays are copied with memcpy
+        index = SearchIndex(self.k1, self.b)
+        index.postings = {t: postings[:] for t, postings in self.postings.items()}
+        index.ids = list(self.ids)
+        index.lengths = self.lengths[:]
+        index.docs = dict(self.docs)
+        index.total_length = self.total_length
+        index.watermark = self.watermark
+        return index
+
+    def dump(self):
+        # json document of the index, see load()
+        return dict(version=SNAPSHOT_VERSION, byteorder=sys.byteorder, itemsize=self.lengths.itemsize,
+                    k1=self.k1, b=self.b, ids=self.ids, lengths=_encode_array(self.lengths),
+                    postings={t: _encode_array(p) for t, p in self.postings.items()},
+                    docs={blog_id: [doc, list(terms), created_at] for blog_id, (doc, terms, created_at) in self.docs.items()},
+                    total_length=self.total_length, watermark=self.watermark)
+
+    @classmethod
+    def load(cls, d):
+        # the index of a dump(), None when it was written by another version or another kind of machine
+        if d.get('version') != SNAPSHOT_VERSION or d.get('byteorder') != sys.byteorder \
+                or d.get('itemsize') != array('I').itemsize:
+            return None
+        index = cls(float(d['k1']), float(d['b']))
+        index.ids = list(d['ids'])
+        index.lengths = _decode_array(d['lengths'])
+        index.postings = {t: _decode_array(p) for t, p in d['postings'].items()}
+        index.docs = {blog_id: (int(doc), tuple(terms), float(created_at)) for blog_id, (doc, terms, created_at) in d['docs'].items()}
+        index.total_length = int(d['total_length'])
+        index.watermark = float(d['watermark'])
+        return index
+
+
+def _encode_array(a):
+    return base64.b64encode(a.tobytes()).decode('ascii')
+
+
+def _decode_array(s):
+    a = array('I')
+    a.frombytes(base64.b64decode(s))
+    return a
+
+
+# the index of the process, None until start() has loaded it
+_index = None
+_sync = None
+_dirty = False
+_snapshot = None
+# whether this process writes the snapshot, one worker does it for all, they index the same blogs
+_writer = True
+
+
+def get_index():
+    return _index
+
+
+def index_blog(blog):
+    '''
+    Add or replace the blog in the index, must be called after a blog is created or updated.
+    '''
+    global _dirty
+    if _index is not None:
+        _index.add(blog)
+        _dirty = True
+
+
+def remove_blog(blog_id):
+    global _dirty
+    if _index is not None and _index.remove(blog_id):
+        _dirty = True
+
+
+def search(query, limit=10):
+    start = time.perf_counter()
+    results = _index.search(query, limit)
+    metrics.observe('search_duration_seconds', 'Search index lookup time.', (), time.perf_counter() - start)
+    return results
+
+
+def write_snapshot(index, path):
+    '''
+    Compact index and write it to path, index must not change meanwhile, see save_snapshot().
+    '''
+    index = index.compact()
+    tmp = '%s.%s.tmp' % (path, os.getpid())
+    # readable by this user only, load_snapshot() refuses a file others may write
+    with open(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w', encoding='utf-8') as f:
+        json.dump(index.dump(), f, ensure_ascii=False, separators=(',', ':'))
+    # a reader always sees a whole file
+    os.replace(tmp, path)
+    logging.info('search index snapshot of %s blogs saved to %s' % (len(index), path))
+
+
+async def save_snapshot(path):
+    # only the copy runs on the event loop, the compaction and json encoding of the index take seconds
+    global _dirty
+    index = _index.copy()
+    _dirty = False
+    try:
+        await asyncio.get_event_loop().run_in_executor(None, write_snapshot, index, path)
+    except BaseException:
+        _dirty = True
+        raise
+
+
+def load_snapshot(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            st = os.fstat(f.fileno())
+            # a file another user could have written is not trusted, the index is rebuilt
+            if st.st_uid != os.getuid() or st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+                logging.warning('search index snapshot %s ignored, not owned by this user or writable by others' % path)
+                return None
+            index = SearchIndex.load(json.load(f))
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logging.warning('cannot load search index snapshot %s: %s' % (path, e))
+        return None
+    if index is None:
+        return None
+    logging.info('search index snapshot of %s blogs loaded from %s' % (len(index), path))
+    return index
+
+
+async def sync():
+    '''
+    Index the blogs written since the watermark, by this or another process, and drop the deleted ones.
+    api_update_blog resets created_at, so updated blogs are found by the watermark too.
+    '''
+    global _dirty
+    changed = 0
+    since = _index.watermark - SYNC_WINDOW if _index.watermark else 0.0
+    async for blogs in Blog.stream('created_at>?', [since], fields=_FIELDS, readonly=True):
+        for blog in blogs:
+            if not _index.indexed(blog):
+                _index.add(blog)
+                changed += 1
+    num = await Blog.findNumber('count(id)')
+    if num != len(_index):
+        ids = set(b.id for b in await Blog.findAll(fields=('id',), readonly=True))
+        for blog_id in [i for i in _index.docs if i not in ids]:
+            _index.remove(blog_id)
+            changed += 1
+    if changed:
+        _dirty = True
+    return changed
+
+
+async def _run_sync(interval):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await sync()
+            if _dirty and _writer:
+                await save_snapshot(_snapshot)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.warning('search index sync failed: %s' % e)
+
+
+async def start(writer=True, **kw):
+    '''
+    Load the index from the snapshot and catch up with the database, or build it when there is none.
+    The snapshot is saved by the process started with writer=True only.
+    '''
+    global _index, _sync, _snapshot, _writer
+    if not kw.get('enabled', True):
+        return
+    _writer = writer
+    _snapshot = kw.get('snapshot', None)
+    if not _snapshot:
+        os.makedirs(DATA_DIR, mode=0o700, exist_ok=True)
+        _snapshot = os.path.join(DATA_DIR, 'search.idx')
+    start_time = time.time()
+    _index = load_snapshot(_snapshot) or SearchIndex(kw.get('k1', 1.2), kw.get('b', 0.75))
+    changed = await sync()
+    logging.info('search index of %s blogs ready, %s changed since the snapshot, in %.2fs' % (
+        len(_index), changed, time.time() - start_time))
+    _sync = asyncio.ensure_future(_run_sync(kw.get('sync_interval', 30)))
+
+
+async def stop():
+    global _sync
+    if _sync is not None:
+        _sync.cancel()
+        _sync = None
+    if _index is not None and _dirty and _writer:
+        await save_snapshot(_snapshot)
+
+
+metrics.gauge('search_index_blogs', 'Blogs in the search index.', lambda: len(_index) if _index is not None else 0)
+metrics.gauge('search_index_terms', 'Terms in the search index.', lambda: len(_index.postings) if _index is not None else 0)
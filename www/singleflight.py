@@ -0,0 +1,60 @@
+import asyncio, logging
+from aiohttp import web
+
+logging.basicConfig(level=logging.INFO)
+
+# headers which belong to a single response and are never copied to another one
+_SKIPPED_HEADERS = ('Date', 'Content-Length')
+
+
+def copy_response(res):
+    '''
+    Return a copy of res which can be sent to another request, None when res cannot be shared:
+    a streamed body is consumed by one request and cookies belong to one client. An HTTPException
+    is copied as a plain response of the same status and headers, i.e. a 304 without body.
+    '''
+    if not isinstance(res, web.Response) or not isinstance(res.body, (bytes, type(None))) or res.cookies:
+        return None
+    headers = [(k, v) for k, v in res.headers.items() if k not in _SKIPPED_HEADERS]
+    return web.Response(status=res.status, reason=res.reason, body=res.body, headers=headers)
+
+
+class SingleFlight(object):
+    '''
+    Run one call at a time per key, the callers arriving while it is in flight wait for its result
+    instead of running it again. The call runs in a task of its own, so it goes on for the waiters
+    when the caller which started it goes away. An exception of the call is raised in every waiter as
+    the same instance, an exception which is sent once, like aiohttp's HTTPException, must be returned
+    by func instead, see factories.single_flight_factory.
+    '''
+
+    def __init__(self):
+        # key => task in flight
+        self._calls = dict()
+        self.calls = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._calls)
+
+    async def do(self, key, func):
+        # return (result, whether it was shared from a call in flight)
+        task = self._calls.get(key, None)
+        shared = task is not None
+        if shared:
+            self.coalesced += 1
+        else:
+            self.calls += 1
+            task = self._calls[key] = asyncio.ensure_future(func())
+            task.add_done_callback(lambda t: self._done(key, t))
+        return await asyncio.shield(task), shared
+
+    def _done(self, key, task):
+        if self._calls.get(key, None) is task:
+            del self._calls[key]
+        # every waiter may be gone, mark the exception retrieved
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self):
+        return dict(in_flight=len(self._calls), calls=self.calls, coalesced=self.coalesced)
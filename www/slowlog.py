@@ -0,0 +1,57 @@
+import os, sys, time, logging
+from collections import deque
+
+logging.basicConfig(level=logging.INFO)
+
+# frames of these files are skipped when looking for the caller of a statement
+_SKIPPED_FILES = ('orm.py', 'slowlog.py')
+
+
+def find_caller():
+    f = sys._getframe(1)
+    while f is not None and os.path.basename(f.f_code.co_filename) in _SKIPPED_FILES:
+        f = f.f_back
+    if f is None:
+        return None
+    return '%s:%s %s()' % (os.path.basename(f.f_code.co_filename), f.f_lineno, f.f_code.co_name)
+
+
+class SlowQueryLog(object):
+    '''
+    Ring buffer of the statements slower than threshold seconds, with the EXPLAIN
+    output captured the first time each statement template is found slow.
+    '''
+
+    def __init__(self, threshold=0.5, size=200, explain=True):
+        self.threshold = threshold
+        self.explain = explain
+        self._entries = deque(maxlen=size)
+        # statement template => EXPLAIN rows, None while the EXPLAIN is running
+        self._explained = dict()
+
+    def record(self, sql, args, elapsed, rows):
+        # only the types of the arguments are kept, the values may be private
+        entry = dict(time=time.time(), sql=sql, args=[type(a).__name__ for a in args or ()],
+                     elapsed=elapsed, rows=rows, caller=find_caller())
+        self._entries.append(entry)
+        logging.warning('slow query %.3fs from %s: %s' % (elapsed, entry['caller'], sql))
+
+    def need_explain(self, sql):
+        # return True only once per statement template
+        if not self.explain or sql in self._explained:
+            return False
+        self._explained[sql] = None
+        return True
+
+    def set_explain(self, sql, rows):
+        # keep JSON friendly values only, i.e. a Decimal becomes a str
+        self._explained[sql] = [{k: v if v is None or isinstance(v, (str, int, float)) else str(v)
+                                 for k, v in r.items()} for r in rows]
+
+    def entries(self):
+        # newest first
+        return [dict(entry, explain=self._explained.get(entry['sql'], None)) for entry in reversed(self._entries)]
+
+    def clear(self):
+        self._entries.clear()
+        self._explained.clear()
@@ -3,13 +3,19 @@ import logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s',
                     datefmt='%a, %m/%d/%Y %H:%M:%S')
 
-import asyncio, os, json, time
+import argparse, asyncio, os, json, signal, socket, time
 from datetime import datetime
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
 from aiohttp import web
-from factories import logger_factory, data_factory, response_factory, auth_factory
+from factories import metrics_factory, static_factory, logger_factory, data_factory, response_factory, auth_factory, \
+    page_cache_factory, loader_factory, single_flight_factory
 from coreweb import add_routes, add_static
-from orm import create_pool
+from orm import create_pool, destroy_pool, set_slow_query_log
+import search
+from slowlog import SlowQueryLog
+from assets import StaticFiles
+from conditional import set_version_salt, tree_version
+from fragments import FragmentCacheExtension
 from config import configs
 
 
@@ -21,7 +27,9 @@ def init_jinja2(app, **kwargs):
         block_end_string=kwargs.get('block_end_string', '%}'),
         variable_start_string=kwargs.get('variable_start_string', '{{'),
         variable_end_string=kwargs.get('variable_end_string', '}}'),
-        auto_reload=kwargs.get('auto_reload', True)
+        auto_reload=kwargs.get('auto_reload', True),
+        bytecode_cache=kwargs.get('bytecode_cache', None),
+        extensions=kwargs.get('extensions', ())
     )
     path = kwargs.get('path', None)
     if path is None:
@@ -32,6 +40,14 @@ def init_jinja2(app, **kwargs):
     if filter is not None:
         for name, f in filter.items():
             env.filters[name] = f
+    functions = kwargs.get('globals', None)
+    if functions is not None:
+        for name, f in functions.items():
+            env.globals[name] = f
+    if kwargs.get('preload', False):
+        # compile (or load from the bytecode cache) every template before the first request
+        for name in env.list_templates():
+            env.get_template(name)
     app['__templating__'] = env
 
 
@@ -49,18 +65,167 @@ def datetime_filter(t):
     return u'%s/%s/%s' % (dt.month, dt.day, dt.year)
 
 
-async def init(loop):
+async def init(loop, worker_id=0):
+    # called in each worker process, so every worker has its own aiomysql pool
+    set_slow_query_log(SlowQueryLog(**configs.slow_query))
     await create_pool(loop=loop, **configs.db)
-    app = web.Application(loop=loop, middlewares=[logger_factory, data_factory, auth_factory, response_factory])
-    init_jinja2(app, filter=dict(datetime=datetime_filter))
+    # the workers index the same blogs, the first one saves the search snapshot for all
+    await search.start(writer=worker_id == 0, **configs.search)
+    app = web.Application(middlewares=[metrics_factory, static_factory, logger_factory, loader_factory, data_factory,
+                                       auth_factory, page_cache_factory, single_flight_factory, response_factory])
+    if configs.static.memory:
+        static_files = StaticFiles(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static'),
+                                   max_age=configs.static.max_age, gzip_level=configs.static.gzip_level,
+                                   immutable_max_age=configs.static.immutable_max_age)
+        app['__static__'] = static_files
+        asset_url = static_files.url
+    else:
+        # files served from disk are not fingerprinted
+        asset_url = lambda name: '/static/' + name
+    production = configs.templates.production
+    bytecode_cache_dir = configs.templates.bytecode_cache_dir
+    if production and bytecode_cache_dir:
+        # FileSystemBytecodeCache does not create its directory, the first render would fail
+        os.makedirs(bytecode_cache_dir, mode=0o700, exist_ok=True)
+    init_jinja2(app, filter=dict(datetime=datetime_filter), globals=dict(asset_url=asset_url),
+                auto_reload=not production, preload=production, extensions=(FragmentCacheExtension,),
+                bytecode_cache=FileSystemBytecodeCache(bytecode_cache_dir) if production else None)
+    # the pages answered 304 by a version check must be rendered again after a deploy
+    root = os.path.dirname(os.path.abspath(__file__))
+    set_version_salt(tree_version(os.path.join(root, 'templates'), os.path.join(root, 'static')))
     add_routes(app, 'handler')
     add_static(app)
-    # app.router.add_route('GET', '/', index)
-    srv = await loop.create_server(app.make_handler(), '127.0.0.1', 8080)
-    logging.info('server started at http://127.0.0.1:8080...')
-    return srv
+    return app
 
 
-loop = asyncio.get_event_loop()
-loop.run_until_complete(init(loop))
-loop.run_forever()
+def create_socket(host, port, backlog, reuse_port):
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        # every worker binds its own socket and the kernel balances the connections
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.setblocking(False)
+    return sock
+
+
+def new_event_loop(name):
+    if name == 'uvloop':
+        try:
+            import uvloop
+            return uvloop.new_event_loop()
+        except ImportError:
+            logging.warning('uvloop is not installed, using the asyncio event loop')
+    elif name != 'asyncio':
+        raise ValueError('Unknown event loop: %s' % name)
+    return asyncio.new_event_loop()
+
+
+def runner_options(server):
+    # aiohttp request handler tuning
+    return dict(keepalive_timeout=server.keepalive_timeout, max_line_size=server.max_line_size,
+                max_field_size=server.max_field_size,
+                access_log=logging.getLogger('aiohttp.access') if server.access_log else None)
+
+
+def run_worker(server, sock=None, worker_id=0):
+    '''
+    Serve on sock (or on a SO_REUSEPORT socket of its own) until SIGTERM / SIGINT,
+    then stop accepting and let the requests in flight finish within shutdown_timeout.
+    worker_id is the index of the worker, a restarted worker keeps the index of the one it replaces.
+    '''
+    loop = new_event_loop(server.loop)
+    asyncio.set_event_loop(loop)
+    app = loop.run_until_complete(init(loop, worker_id))
+    runner = web.AppRunner(app, shutdown_timeout=server.shutdown_timeout, **runner_options(server))
+    loop.run_until_complete(runner.setup())
+    if sock is None:
+        sock = create_socket(server.host, server.port, server.backlog, True)
+    site = web.SockSite(runner, sock)
+    loop.run_until_complete(site.start())
+    logging.info('worker %s serving at http://%s:%s with %s...' % (
+        os.getpid(), server.host, server.port, type(loop).__module__))
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, loop.stop)
+    try:
+        loop.run_forever()
+    finally:
+        logging.info('worker %s draining...' % os.getpid())
+        loop.run_until_complete(runner.cleanup())
+        loop.run_until_complete(search.stop())
+        loop.run_until_complete(destroy_pool())
+        loop.close()
+
+
+def run_master(server):
+    '''
+    Fork server.workers workers (default: the number of CPUs), restart the crashed ones,
+    and forward SIGTERM / SIGINT to all of them for a graceful shutdown.
+    '''
+    workers = server.workers or os.cpu_count() or 1
+    # without SO_REUSEPORT the workers share the socket bound here
+    sock = None if server.reuse_port else create_socket(server.host, server.port, server.backlog, False)
+    children = dict()
+    stopping = False
+
+    def spawn(index):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            code = 0
+            try:
+                run_worker(server, sock, index)
+            except BaseException as e:
+                logging.exception(e)
+                code = 1
+            finally:
+                logging.shutdown()
+                os._exit(code)
+        children[pid] = index
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    logging.info('master %s starting %s workers at http://%s:%s...' % (os.getpid(), workers, server.host, server.port))
+    for i in range(workers):
+        spawn(i)
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        index = children.pop(pid, None)
+        if index is None or stopping:
+            continue
+        logging.warning('worker %s exited with status %s, restarting...' % (pid, status))
+        # do not spin when the workers cannot start at all, i.e. the database is down
+        time.sleep(1)
+        if not stopping:
+            spawn(index)
+    logging.info('master %s stopped' % os.getpid())
+
+
+def main(argv=None):
+    server = configs.server
+    parser = argparse.ArgumentParser(description='awesome web server')
+    parser.add_argument('--host', default=server.host)
+    parser.add_argument('--port', type=int, default=server.port)
+    parser.add_argument('--workers', type=int, default=server.workers, help='0 for the number of CPUs')
+    parser.add_argument('--loop', choices=('uvloop', 'asyncio'), default=server.loop)
+    args = parser.parse_args(argv)
+    server.host, server.port, server.workers, server.loop = args.host, args.port, args.workers, args.loop
+    run_master(server)
+
+
+if __name__ == '__main__':
+    main()